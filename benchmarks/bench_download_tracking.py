@@ -0,0 +1,86 @@
+"""GET /pdf_note latency: S3 metadata rewrite vs the PdfDownloads record.
+
+    python benchmarks/bench_download_tracking.py --downloads 200 --size-kb 200
+
+Before, every download read the note and client, then did head_object
+and a copy_object of the PDF onto itself to set nota-descargada, then the
+get_object. Now it is one conditional update_item on PdfDownloads plus the
+get_object (sales_lambda.get_pdf_note, client from the warm cache). Prints
+AWS calls per download and p50/p99 over --downloads downloads of one PDF.
+moto copies an object in memory, so it understates what the S3 server-side
+copy used to cost.
+"""
+import argparse
+import base64
+import os
+import time
+
+import boto3
+import moto
+
+from common import create_table, percentile, print_table, use_package
+
+use_package('sales')
+
+
+def download_before(dynamodb, s3, bucket, key):
+    """The tracked download as it was: flip the flag in the metadata, then read."""
+    note = dynamodb.Table('SalesNotes').get_item(Key={'ID': 'n1'})['Item']
+    dynamodb.Table('Clients').get_item(Key={'ID': note['ClienteID']})
+    head = s3.head_object(Bucket=bucket, Key=key)
+    metadata = dict(head.get('Metadata', {}), **{'nota-descargada': 'true'})
+    s3.copy_object(
+        Bucket=bucket, CopySource={'Bucket': bucket, 'Key': key}, Key=key,
+        Metadata=metadata, MetadataDirective='REPLACE'
+    )
+    return base64.b64encode(s3.get_object(Bucket=bucket, Key=key)['Body'].read()).decode('utf-8')
+
+
+def latencies(function, count):
+    times = []
+    for _ in range(count):
+        start = time.perf_counter()
+        function()
+        times.append((time.perf_counter() - start) * 1000)
+    return times
+
+
+def main(downloads, size_kb):
+    with moto.mock_aws():
+        import sales_lambda
+
+        client = boto3.client('dynamodb')
+        for name in ['Clients', 'SalesNotes', 'PdfDownloads', 'CacheVersions']:
+            create_table(client, name)
+        s3 = boto3.client('s3')
+        s3.create_bucket(Bucket=sales_lambda.BUCKET_NAME)
+        dynamodb = boto3.resource('dynamodb')
+        dynamodb.Table('Clients').put_item(Item={'ID': 'c1', 'RFC': 'XAXX010101000', 'RazonSocial': 'ACME'})
+        dynamodb.Table('SalesNotes').put_item(Item={'ID': 'n1', 'ClienteID': 'c1', 'Folio': 'F1'})
+        key = 'XAXX010101000/F1.pdf'
+        s3.put_object(Bucket=sales_lambda.BUCKET_NAME, Key=key, Body=os.urandom(size_kb * 1024), Metadata={'veces-enviado': '1'})
+        sales_lambda.PDF_INLINE_MAX_BYTES = size_kb * 1024
+
+        calls = []
+        for aws_client in {s3, dynamodb.meta.client, sales_lambda.s3, sales_lambda.dynamodb.meta.client}:
+            aws_client.meta.events.register('before-call.*.*', lambda **kwargs: calls.append(1))
+
+        before = latencies(lambda: download_before(dynamodb, s3, sales_lambda.BUCKET_NAME, key), downloads)
+        before_calls = len(calls) / downloads
+        calls.clear()
+        after = latencies(lambda: sales_lambda.get_pdf_note({}, {'id': 'n1'}, None), downloads)
+        after_calls = len(calls) / downloads
+        record = dynamodb.Table('PdfDownloads').get_item(Key={'ID': key})['Item']
+        assert record['Descargas'] == downloads
+        print_table(['path', 'calls', 'p50 ms', 'p99 ms'], [
+            ['copy_object metadata', f'{before_calls:.1f}', f'{percentile(before, 0.5):.2f}', f'{percentile(before, 0.99):.2f}'],
+            ['PdfDownloads update', f'{after_calls:.1f}', f'{percentile(after, 0.5):.2f}', f'{percentile(after, 0.99):.2f}'],
+        ])
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--downloads', type=int, default=200)
+    parser.add_argument('--size-kb', type=int, default=200)
+    args = parser.parse_args()
+    main(args.downloads, args.size_kb)
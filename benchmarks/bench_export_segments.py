@@ -0,0 +1,60 @@
+"""catalogs_export throughput against the number of parallel scan segments.
+
+    python benchmarks/bench_export_segments.py --items 20000 --segments 1,2,4,8,16
+
+Exports one table of --items ~1 KB items to S3 (gzip NDJSON) per segment
+count. moto answers a scan page in-process, while DynamoDB takes tens of
+milliseconds to return a 1 MB page, and that wait is what the segments
+overlap; --page-ms adds that service time to every Scan call (0 measures
+moto alone, where the GIL leaves nothing to overlap).
+"""
+import argparse
+import time
+
+import boto3
+import moto
+
+from common import create_table, print_table, use_package
+
+use_package('catalogs')
+
+
+def main(items, segment_counts, page_ms):
+    with moto.mock_aws():
+        import aws
+        import catalogs_export
+
+        create_table(boto3.client('dynamodb'), 'Products')
+        s3 = boto3.client('s3')
+        s3.create_bucket(Bucket='exports')
+        table = boto3.resource('dynamodb').Table('Products')
+        with table.batch_writer() as batch:
+            for n in range(items):
+                batch.put_item(Item={'ID': f'p{n:07d}', 'Nombre': f'Producto {n}', 'Descripcion': 'x' * 1000})
+
+        pages = []
+
+        def service_time(**kwargs):
+            pages.append(1)
+            time.sleep(page_ms / 1000)
+
+        aws.resource('dynamodb').meta.client.meta.events.register('after-call.dynamodb.Scan', service_time)
+
+        results = []
+        for segments in segment_counts:
+            pages.clear()
+            start = time.perf_counter()
+            summary = catalogs_export.export_table('Products', 'exports', f'products-{segments}.ndjson.gz', segments=segments, s3=s3)
+            seconds = time.perf_counter() - start
+            assert summary['Items'] == items
+            results.append([segments, len(pages), f'{seconds:.2f}', f'{items / seconds:,.0f}'])
+        print_table(['segments', 'scan calls', 'seconds', 'items/s'], results)
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--items', type=int, default=20000)
+    parser.add_argument('--segments', default='1,2,4,8,16', help='comma separated segment counts')
+    parser.add_argument('--page-ms', type=float, default=50.0, help='service time added to every Scan call')
+    args = parser.parse_args()
+    main(args.items, [int(n) for n in args.segments.split(',')], args.page_ms)
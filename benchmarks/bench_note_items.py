@@ -0,0 +1,73 @@
+"""Reading one note's items: SalesNoteID-index query vs the old filtered scan.
+
+    python benchmarks/bench_note_items.py --sizes 1000,10000,100000,1000000
+
+The table grows to each size with notes of --note-items items; every step
+reads the same note both ways. Besides the time, it prints the items each
+read makes DynamoDB examine (ScannedCount), which is what it bills and what
+its latency follows. moto evaluates an index query by walking the whole
+table, so on moto the query time grows too, only far less than the scan's;
+on DynamoDB it depends on the note alone.
+"""
+import argparse
+from decimal import Decimal
+
+import boto3
+import moto
+from boto3.dynamodb.conditions import Attr
+
+from common import create_table, print_table, timed, use_package
+
+use_package('sales')
+
+
+def scan_note(table, note_id):
+    """What GET /sales_notes did before the index: every page of a filtered scan."""
+    items, scanned = [], 0
+    scan_kwargs = {'FilterExpression': Attr('SalesNoteID').eq(note_id)}
+    while True:
+        response = table.scan(**scan_kwargs)
+        items.extend(response['Items'])
+        scanned += response['ScannedCount']
+        if 'LastEvaluatedKey' not in response:
+            return items, scanned
+        scan_kwargs['ExclusiveStartKey'] = response['LastEvaluatedKey']
+
+
+def main(sizes, note_items, repeat):
+    with moto.mock_aws():
+        import sales_lambda
+        from schema import SALES_NOTE_ITEMS_INDEX
+
+        create_table(boto3.client('dynamodb'), 'SalesNoteItems', [(SALES_NOTE_ITEMS_INDEX, 'SalesNoteID')])
+        table = boto3.resource('dynamodb').Table('SalesNoteItems')
+        written = 0
+        results = []
+        for size in sizes:
+            with table.batch_writer() as batch:
+                for n in range(written, size):
+                    batch.put_item(Item={
+                        'ID': f'i{n}',
+                        'SalesNoteID': f'n{n // note_items}',
+                        'ProductoID': 'p1',
+                        'Cantidad': 1,
+                        'PrecioUnitario': Decimal('9.99'),
+                        'Importe': Decimal('9.99')
+                    })
+            written = size
+            query_ms, items = timed(lambda: sales_lambda.query_note_items('n0'), repeat)
+            # a query examines only the items under its key, all of which it returns
+            query_scanned = len(items)
+            scan_ms, (scan_items, scan_scanned) = timed(lambda: scan_note(table, 'n0'), repeat)
+            assert len(scan_items) == len(items) == note_items
+            results.append([f'{size:,}', f'{query_ms:.1f}', f'{query_scanned:,}', f'{scan_ms:.1f}', f'{scan_scanned:,}'])
+        print_table(['rows', 'query ms', 'query read', 'scan ms', 'scan read'], results)
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--sizes', default='1000,10000,100000', help='comma separated table sizes')
+    parser.add_argument('--note-items', type=int, default=50)
+    parser.add_argument('--repeat', type=int, default=3)
+    args = parser.parse_args()
+    main([int(size) for size in args.sizes.split(',')], args.note_items, args.repeat)
@@ -0,0 +1,74 @@
+"""GET /pdf_note memory and latency: inline base64 body vs presigned redirect.
+
+    python benchmarks/bench_pdf_delivery.py --sizes-kb 100,1024,5120,20480
+
+Each size is served both ways by sales_lambda.get_pdf_note: inline (the
+threshold raised above it) and redirected (the threshold at 0). Peak memory
+is what tracemalloc sees the handler allocate. Inline bodies over 6 MB do
+not fit in a Lambda response at all; they are marked as such.
+"""
+import argparse
+import base64
+import os
+import tracemalloc
+
+import boto3
+import moto
+
+from common import create_table, print_table, timed, use_package
+
+use_package('sales')
+
+LAMBDA_RESPONSE_LIMIT = 6 * 1024 * 1024
+
+
+def serve(sales_lambda, note_id):
+    tracemalloc.start()
+    response = sales_lambda.get_pdf_note({}, {'id': note_id}, None)
+    peak = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+    return response, peak
+
+
+def main(sizes_kb, repeat):
+    with moto.mock_aws():
+        import sales_lambda
+
+        client = boto3.client('dynamodb')
+        for name in ['Clients', 'SalesNotes', 'PdfDownloads', 'CacheVersions']:
+            create_table(client, name)
+        boto3.client('s3').create_bucket(Bucket=sales_lambda.BUCKET_NAME)
+        dynamodb = boto3.resource('dynamodb')
+        dynamodb.Table('Clients').put_item(Item={'ID': 'c1', 'RFC': 'XAXX010101000', 'RazonSocial': 'ACME'})
+
+        results = []
+        for size_kb in sizes_kb:
+            note_id = f'n{size_kb}'
+            dynamodb.Table('SalesNotes').put_item(Item={'ID': note_id, 'ClienteID': 'c1', 'Folio': f'F{size_kb}'})
+            boto3.client('s3').put_object(
+                Bucket=sales_lambda.BUCKET_NAME, Key=f'XAXX010101000/F{size_kb}.pdf', Body=os.urandom(size_kb * 1024)
+            )
+            row = [f'{size_kb:,}']
+            for inline_max in [size_kb * 1024, 0]:
+                sales_lambda.PDF_INLINE_MAX_BYTES = inline_max
+                ms, (response, peak) = timed(lambda: serve(sales_lambda, note_id), repeat)
+                body = response['body']
+                too_large = len(body) > LAMBDA_RESPONSE_LIMIT
+                assert response['statusCode'] == (200 if inline_max else 302)
+                if inline_max:
+                    assert len(base64.b64decode(body)) == size_kb * 1024
+                row += [f'{ms:.1f}', f'{peak / 1024 / 1024:.1f}', f'{len(body) / 1024:,.0f}' + (' (over 6 MB)' if too_large else '')]
+            results.append(row)
+        print_table([
+            'PDF KB',
+            'inline ms', 'inline peak MB', 'inline body KB',
+            'redirect ms', 'redirect peak MB', 'redirect body KB'
+        ], results)
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--sizes-kb', default='100,1024,5120,20480', help='comma separated PDF sizes in KiB')
+    parser.add_argument('--repeat', type=int, default=5)
+    args = parser.parse_args()
+    main([int(size) for size in args.sizes_kb.split(',')], args.repeat)
@@ -0,0 +1,71 @@
+"""Resolving a note's products: one get_item per line vs batch_get_item.
+
+    python benchmarks/bench_product_lookups.py --lines 10,50,200,500
+
+Lines draw their product from a catalog of --products items, so larger
+notes repeat products. For each note size it prints the DynamoDB round
+trips and the time on moto, plus the time with --rtt-ms added per round
+trip, since moto answers in-process and a Lambda pays a network round
+trip for every call.
+"""
+import argparse
+import random
+
+import boto3
+import moto
+
+from common import create_table, print_table, timed, use_package
+
+use_package('sales')
+
+
+def per_line(table, lines):
+    """What generate_pdf did before: a get_item for every item row."""
+    return {product_id: table.get_item(Key={'ID': product_id})['Item'] for product_id in lines}
+
+
+def main(sizes, catalog, rtt_ms):
+    with moto.mock_aws():
+        import sales_lambda
+
+        create_table(boto3.client('dynamodb'), 'Products')
+        table = boto3.resource('dynamodb').Table('Products')
+        with table.batch_writer() as batch:
+            for n in range(catalog):
+                batch.put_item(Item={'ID': f'p{n}', 'Nombre': f'Producto {n}', 'UnidadMedida': 'pz'})
+
+        calls = []
+        for client in {table.meta.client, sales_lambda.dynamodb.meta.client}:
+            client.meta.events.register('before-call.dynamodb.*', lambda **kwargs: calls.append(1))
+
+        rng = random.Random(2)
+        results = []
+        for size in sizes:
+            lines = [f'p{rng.randrange(catalog)}' for _ in range(size)]
+            calls.clear()
+            line_ms, by_line = timed(lambda: per_line(table, lines), 1)
+            line_calls = len(calls)
+            calls.clear()
+            # fetch_products is resolve_products without the warm-container cache
+            batch_ms, batched = timed(lambda: sales_lambda.fetch_products(lines), 1)
+            batch_calls = len(calls)
+            assert by_line == batched
+            results.append([
+                size, len(set(lines)),
+                line_calls, f'{line_ms:.1f}', f'{line_ms + line_calls * rtt_ms:.0f}',
+                batch_calls, f'{batch_ms:.1f}', f'{batch_ms + batch_calls * rtt_ms:.0f}'
+            ])
+        print_table([
+            'lines', 'products',
+            'get_item calls', 'ms', f'ms at {rtt_ms:g} ms RTT',
+            'batch calls', 'ms', f'ms at {rtt_ms:g} ms RTT'
+        ], results)
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--lines', default='10,50,200,500', help='comma separated note sizes')
+    parser.add_argument('--products', type=int, default=300, help='catalog size')
+    parser.add_argument('--rtt-ms', type=float, default=5.0, help='network round trip added per call')
+    args = parser.parse_args()
+    main([int(size) for size in args.lines.split(',')], args.products, args.rtt_ms)
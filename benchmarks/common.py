@@ -0,0 +1,73 @@
+"""Helpers shared by the benchmarks, which run against moto as the AWS stand-in.
+
+moto keeps everything in memory and answers in-process, so absolute times
+are not DynamoDB's or S3's; the benchmarks compare access patterns (how
+many calls, how many items read, how the time grows with the data) rather
+than production latencies.
+"""
+import os
+import statistics
+import sys
+import time
+
+ROOT = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..')
+
+for name, value in {
+    'AWS_DEFAULT_REGION': 'us-east-1',
+    'AWS_ACCESS_KEY_ID': 'testing',
+    'AWS_SECRET_ACCESS_KEY': 'testing',
+}.items():
+    os.environ.setdefault(name, value)
+
+
+def use_package(package):
+    """Make a Lambda directory (sales, catalogs) importable, like its image does."""
+    sys.path.insert(0, os.path.join(ROOT, package))
+
+
+def create_table(client, name, indexes=(), range_key=None):
+    """PAY_PER_REQUEST table keyed by ID; indexes are (name, hash key[, range key])."""
+    attributes = {'ID': 'S'}
+    key_schema = [{'AttributeName': 'ID', 'KeyType': 'HASH'}]
+    if range_key:
+        attributes[range_key] = 'S'
+        key_schema.append({'AttributeName': range_key, 'KeyType': 'RANGE'})
+    kwargs = {}
+    if indexes:
+        kwargs['GlobalSecondaryIndexes'] = []
+        for index_name, *keys in indexes:
+            for key in keys:
+                attributes[key] = 'S'
+            kwargs['GlobalSecondaryIndexes'].append({
+                'IndexName': index_name,
+                'KeySchema': [{'AttributeName': key, 'KeyType': key_type} for key, key_type in zip(keys, ['HASH', 'RANGE'])],
+                'Projection': {'ProjectionType': 'ALL'},
+            })
+    client.create_table(
+        TableName=name,
+        KeySchema=key_schema,
+        AttributeDefinitions=[{'AttributeName': k, 'AttributeType': t} for k, t in attributes.items()],
+        BillingMode='PAY_PER_REQUEST',
+        **kwargs
+    )
+
+
+def timed(function, repeat=5):
+    """(median ms, last result) of repeat calls."""
+    times = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        result = function()
+        times.append((time.perf_counter() - start) * 1000)
+    return statistics.median(times), result
+
+
+def percentile(values, fraction):
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(fraction * len(ordered)))]
+
+
+def print_table(header, rows):
+    widths = [max(len(str(cell)) for cell in column) for column in zip(header, *rows)]
+    for row in [header] + rows:
+        print('  '.join(str(cell).rjust(width) for cell, width in zip(row, widths)))
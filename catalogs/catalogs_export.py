@@ -0,0 +1,190 @@
+import argparse
+import gzip
+import json
+import os
+import queue
+import threading
+import time
+from datetime import datetime
+
+import aws
+from json_encoding import dumps
+
+CATALOG_TABLES = ['Clients', 'Addresses', 'Products']
+EXPORT_BUCKET = os.getenv('EXPORT_BUCKET', '')
+EXPORT_SEGMENTS = int(os.getenv('EXPORT_SEGMENTS', '4'))
+# S3 requires every part but the last to be at least 5 MiB
+PART_SIZE = 8 * 1024 * 1024
+# how often a segment blocked on a full queue checks whether the export stopped
+QUEUE_POLL_SECONDS = 1
+
+_DONE = object()
+
+
+class MultipartWriter:
+    """File-like sink that streams bytes to S3 as a multipart upload."""
+
+    def __init__(self, s3, bucket, key, part_size=PART_SIZE):
+        self.s3 = s3
+        self.bucket = bucket
+        self.key = key
+        self.part_size = part_size
+        self.buffer = bytearray()
+        self.parts = []
+        self.upload_id = s3.create_multipart_upload(Bucket=bucket, Key=key)['UploadId']
+
+    def write(self, data):
+        self.buffer.extend(data)
+        if len(self.buffer) >= self.part_size:
+            self._upload_part()
+        return len(data)
+
+    def flush(self):
+        pass
+
+    def _upload_part(self):
+        part_number = len(self.parts) + 1
+        response = self.s3.upload_part(
+            Bucket=self.bucket,
+            Key=self.key,
+            UploadId=self.upload_id,
+            PartNumber=part_number,
+            Body=bytes(self.buffer)
+        )
+        self.parts.append({'ETag': response['ETag'], 'PartNumber': part_number})
+        self.buffer.clear()
+
+    def close(self):
+        if self.buffer or not self.parts:
+            self._upload_part()
+        self.s3.complete_multipart_upload(
+            Bucket=self.bucket,
+            Key=self.key,
+            UploadId=self.upload_id,
+            MultipartUpload={'Parts': self.parts}
+        )
+
+    def abort(self):
+        self.s3.abort_multipart_upload(Bucket=self.bucket, Key=self.key, UploadId=self.upload_id)
+
+
+def put_page(pages, page, stop):
+    """Queue page, waiting for room unless the export stops; False if it did."""
+    while not stop.is_set():
+        try:
+            pages.put(page, timeout=QUEUE_POLL_SECONDS)
+            return True
+        except queue.Full:
+            pass
+    return False
+
+
+def scan_segment(table_name, segment, total_segments, pages, stop):
+    # the resource's client is thread-safe and still deserializes items
+    client = aws.resource('dynamodb').meta.client
+    scan_kwargs = {'TableName': table_name, 'Segment': segment, 'TotalSegments': total_segments}
+    try:
+        while not stop.is_set():
+            response = client.scan(**scan_kwargs)
+            if response['Items'] and not put_page(pages, response['Items'], stop):
+                return
+            if 'LastEvaluatedKey' not in response:
+                put_page(pages, _DONE, stop)
+                return
+            scan_kwargs['ExclusiveStartKey'] = response['LastEvaluatedKey']
+    except Exception as e:
+        put_page(pages, e, stop)
+
+
+def export_table(table_name, bucket, key, segments=EXPORT_SEGMENTS, compress=True, s3=None):
+    """Parallel-scan a table and stream it to s3://bucket/key as NDJSON.
+
+    Pages flow through a bounded queue, so at most a few pages per segment
+    are held in memory regardless of table size. If the export fails, the
+    scans are stopped and the queued pages dropped, so a warm container
+    keeps neither.
+    """
+    s3 = s3 or aws.client('s3')
+    pages = queue.Queue(maxsize=segments * 2)
+    stop = threading.Event()
+    workers = [
+        threading.Thread(target=scan_segment, args=(table_name, segment, segments, pages, stop), daemon=True)
+        for segment in range(segments)
+    ]
+    for worker in workers:
+        worker.start()
+
+    count = 0
+    start = time.time()
+    writer = None
+    try:
+        writer = MultipartWriter(s3, bucket, key)
+        sink = gzip.GzipFile(fileobj=writer, mode='wb') if compress else writer
+        finished = 0
+        while finished < segments:
+            page = pages.get()
+            if page is _DONE:
+                finished += 1
+                continue
+            if isinstance(page, Exception):
+                raise page
+            sink.write(''.join(dumps(item) + '\n' for item in page).encode('utf-8'))
+            count += len(page)
+        if compress:
+            sink.close()
+        writer.close()
+    except Exception:
+        stop.set()
+        while True:
+            try:
+                pages.get_nowait()
+            except queue.Empty:
+                break
+        for worker in workers:
+            worker.join(QUEUE_POLL_SECONDS * 2)
+        if writer:
+            try:
+                writer.abort()
+            except Exception as e:
+                print(f'Error aborting upload of {key}: {e}')
+        raise
+    return {'Table': table_name, 'Key': key, 'Items': count, 'Seconds': round(time.time() - start, 3)}
+
+
+def export_catalogs(bucket, tables=None, segments=EXPORT_SEGMENTS, compress=True, prefix=None):
+    prefix = prefix or f"exports/{datetime.utcnow().strftime('%Y-%m-%dT%H-%M-%S')}"
+    extension = 'ndjson.gz' if compress else 'ndjson'
+    return [
+        export_table(table_name, bucket, f'{prefix}/{table_name}.{extension}', segments, compress)
+        for table_name in (tables or CATALOG_TABLES)
+    ]
+
+
+def lambda_handler(event, context):
+    """
+    Export entry point, e.g. for a nightly scheduled rule.
+    Optional event fields: bucket, tables, segments, format ("ndjson" or "gzip"), prefix.
+    """
+    bucket = event.get('bucket', EXPORT_BUCKET)
+    if not bucket:
+        return {'statusCode': 400, 'body': json.dumps({'error': 'Missing export bucket'})}
+    results = export_catalogs(
+        bucket,
+        tables=event.get('tables'),
+        segments=int(event.get('segments', EXPORT_SEGMENTS)),
+        compress=event.get('format', 'gzip') == 'gzip',
+        prefix=event.get('prefix')
+    )
+    return {'statusCode': 200, 'body': json.dumps({'exports': results})}
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Export catalog tables to S3 as NDJSON')
+    parser.add_argument('--bucket', default=EXPORT_BUCKET, required=not EXPORT_BUCKET)
+    parser.add_argument('--tables', nargs='+', default=CATALOG_TABLES)
+    parser.add_argument('--segments', type=int, default=EXPORT_SEGMENTS)
+    parser.add_argument('--format', choices=['ndjson', 'gzip'], default='gzip')
+    parser.add_argument('--prefix')
+    args = parser.parse_args()
+    for result in export_catalogs(args.bucket, args.tables, args.segments, args.format == 'gzip', args.prefix):
+        print(json.dumps(result))
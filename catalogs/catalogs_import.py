@@ -0,0 +1,303 @@
+"""Bulk import of clients, addresses or products from NDJSON or CSV.
+
+The API route takes the rows inline, e.g. POST /products/import?format=csv
+with a CSV body, or reads them from S3 with ?key=imports/products.ndjson.gz.
+Files too large for the API Gateway timeout can be imported from a shell:
+
+    python catalogs_import.py products imports/products.csv --bucket my-bucket
+    python catalogs_import.py addresses addresses.ndjson --local
+
+Rows are streamed, validated with the same rules as the single-item POST
+routes and written with parallel batch_write_item calls. Rejected rows are
+reported with their line number. A row with an ID overwrites that item, so
+re-running an import after a partial failure does not duplicate it.
+
+Catalogs with a unique field (client RFC) are written with
+transact_write_items instead, one batch per transaction together with the
+guards of their values, so an import cannot register an RFC twice.
+"""
+import argparse
+import base64
+import csv
+import gzip
+import io
+import json
+import os
+import random
+import time
+import uuid
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+
+from botocore.exceptions import ClientError
+
+import aws
+import metrics
+import unique_keys
+from cache import bump_version
+from catalogs_lambda import RESOURCES, dynamodb, item_values, unchanged_condition
+
+IMPORT_BUCKET = os.getenv('IMPORT_BUCKET', '')
+IMPORT_WORKERS = int(os.getenv('IMPORT_WORKERS', '8'))
+BATCH_WRITE_LIMIT = 25
+MAX_RETRIES = 8
+# only the first errors are listed in the report; the rest are just counted
+MAX_REPORTED_ERRORS = 1000
+
+
+def build_item(entity, row):
+    """Validate one row and return the item to store. Raises ValueError."""
+    if not isinstance(row, dict):
+        raise ValueError('Row must be an object')
+    resource = RESOURCES[entity]
+    # CSV has no nulls, so an empty cell counts as a missing field
+    missing = [f for f in resource['fields'] if row.get(f) in (None, '')]
+    if missing:
+        raise ValueError('Missing required fields: ' + ', '.join(missing))
+    values, error = item_values(resource, row)
+    if error:
+        raise ValueError(error)
+    return dict({'ID': str(row.get('ID') or uuid.uuid4())}, **values)
+
+
+def read_rows(stream, fmt):
+    """Yield (line number, row) pairs from a text stream; bad lines yield a ValueError as the row."""
+    if fmt == 'csv':
+        reader = csv.DictReader(stream)
+        for row in reader:
+            yield reader.line_num, row
+        return
+    for line_number, line in enumerate(stream, 1):
+        if not line.strip():
+            continue
+        try:
+            yield line_number, json.loads(line)
+        except ValueError as e:
+            yield line_number, ValueError(f'Invalid JSON: {e}')
+
+
+def detect_format(name):
+    name = name[:-len('.gz')] if name.endswith('.gz') else name
+    return 'csv' if name.endswith('.csv') else 'ndjson'
+
+
+def open_text(raw, compressed):
+    if compressed:
+        raw = gzip.GzipFile(fileobj=raw, mode='rb')
+    # utf-8-sig drops the byte order mark spreadsheet exports put in front of CSVs
+    return io.TextIOWrapper(raw, encoding='utf-8-sig', newline='')
+
+
+def open_s3(bucket, key):
+    body = aws.client('s3').get_object(Bucket=bucket, Key=key)['Body']
+    return open_text(body, key.endswith('.gz'))
+
+
+def write_batch(table_name, batch):
+    """batch_write_item one batch of {ID: (line, item)}; returns [(line, error)] for the rows not written."""
+    requests = {item_id: {'PutRequest': {'Item': item}} for item_id, (_, item) in batch.items()}
+    try:
+        for attempt in range(MAX_RETRIES):
+            response = dynamodb.meta.client.batch_write_item(RequestItems={table_name: list(requests.values())})
+            unprocessed = response.get('UnprocessedItems', {}).get(table_name, [])
+            requests = {r['PutRequest']['Item']['ID']: r for r in unprocessed}
+            if not requests:
+                return []
+            time.sleep(random.uniform(0, min(2.0, 0.05 * 2 ** attempt)))
+        error = f'Not written after {MAX_RETRIES} attempts (throttled)'
+    except Exception as e:
+        error = str(e)
+    return [(batch[item_id][0], error) for item_id in requests]
+
+
+def current_values(table_name, field, item_ids):
+    """{ID: item with only ID and field} of the items that already exist."""
+    request_items = {table_name: {
+        'Keys': [{'ID': item_id} for item_id in item_ids],
+        'ProjectionExpression': 'ID, #u',
+        'ExpressionAttributeNames': {'#u': field},
+        'ConsistentRead': True
+    }}
+    found = {}
+    for attempt in range(MAX_RETRIES):
+        response = dynamodb.meta.client.batch_get_item(RequestItems=request_items)
+        found.update({item['ID']: item for item in response['Responses'].get(table_name, [])})
+        request_items = response.get('UnprocessedKeys')
+        if not request_items:
+            return found
+        time.sleep(random.uniform(0, min(2.0, 0.05 * 2 ** attempt)))
+    raise Exception(f'Could not read {table_name}: unprocessed keys after {MAX_RETRIES} attempts')
+
+
+def write_guarded_batch(resource, batch):
+    """Put one batch of {ID: (line, item)} and its unique-field guards in one transaction.
+
+    Rows whose value belongs to another item, or that changed while being
+    written, are dropped from the batch and reported; the rest is retried.
+    Returns [(line, error)] for the rows not written.
+    """
+    table_name = resource['table'].name
+    field = resource['unique']
+    batch = dict(batch)
+    failures = []
+    try:
+        current = current_values(table_name, field, list(batch))
+        for attempt in range(MAX_RETRIES):
+            claimed = {item[field] for _, item in batch.values()}
+            transact_items, owners = [], []
+            for item_id, (line, item) in batch.items():
+                condition, names, values = unchanged_condition(resource, current.get(item_id))
+                put = {'TableName': table_name, 'Item': item, 'ConditionExpression': condition}
+                if names:
+                    put['ExpressionAttributeNames'] = names
+                if values:
+                    put['ExpressionAttributeValues'] = values
+                transact_items.append({'Put': put})
+                owners.append((item_id, 'changed while importing, run the import again'))
+                old_value = current.get(item_id, {}).get(field)
+                if item[field] != old_value:
+                    transact_items.append(unique_keys.claim(field, item[field], item_id))
+                    owners.append((item_id, f'{field} {item[field]} is already registered'))
+                # a value another row of the batch claims cannot be released in the same transaction
+                if old_value is not None and old_value != item[field] and old_value not in claimed:
+                    transact_items.append(unique_keys.release(field, old_value, item_id))
+                    owners.append((item_id, f'{field} {old_value} is registered to another item'))
+            try:
+                dynamodb.meta.client.transact_write_items(TransactItems=transact_items)
+                return failures
+            except ClientError as e:
+                failed = unique_keys.failed_checks(e)
+            for i in failed:
+                item_id, error = owners[i]
+                if item_id in batch:
+                    failures.append((batch.pop(item_id)[0], error))
+            if not batch:
+                return failures
+            if not failed:
+                # conflicts with concurrent transactions or throttling
+                time.sleep(random.uniform(0, min(2.0, 0.05 * 2 ** attempt)))
+        error = f'Not written after {MAX_RETRIES} attempts (conflicts)'
+    except Exception as e:
+        error = str(e)
+    return failures + [(line, error) for line, _ in batch.values()]
+
+
+def import_rows(entity, rows, workers=IMPORT_WORKERS):
+    """Validate and write (line number, row) pairs; returns the import report."""
+    resource = RESOURCES[entity]
+    table_name = resource['table'].name
+    unique = resource.get('unique')
+    report = {'Entity': entity, 'Rows': 0, 'Imported': 0, 'Failed': 0, 'Errors': []}
+    start = time.time()
+
+    def reject(line, error):
+        report['Failed'] += 1
+        if len(report['Errors']) < MAX_REPORTED_ERRORS:
+            report['Errors'].append({'line': line, 'error': str(error)})
+
+    sizes = {}
+
+    def collect(done):
+        for future in done:
+            failures = future.result()
+            report['Imported'] += sizes.pop(future) - len(failures)
+            for line, error in failures:
+                reject(line, error)
+
+    def submit(batch):
+        if unique:
+            future = executor.submit(write_guarded_batch, resource, batch)
+        else:
+            future = executor.submit(write_batch, table_name, batch)
+        sizes[future] = len(batch)
+        return future
+
+    batch = {}
+    batch_values = set()
+    pending = set()
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        for line, row in rows:
+            report['Rows'] += 1
+            try:
+                if isinstance(row, ValueError):
+                    raise row
+                item = build_item(entity, row)
+            except ValueError as e:
+                reject(line, e)
+                continue
+            # one batch_write_item call cannot put the same key twice, and
+            # one transaction cannot claim the same unique value twice
+            if item['ID'] in batch or len(batch) == BATCH_WRITE_LIMIT or (unique and item[unique] in batch_values):
+                pending.add(submit(batch))
+                batch = {}
+                batch_values = set()
+            batch[item['ID']] = (line, item)
+            if unique:
+                batch_values.add(item[unique])
+            # backpressure: stop reading while every writer is busy
+            if len(pending) >= workers:
+                done, pending = wait(pending, return_when=FIRST_COMPLETED)
+                collect(done)
+        if batch:
+            pending.add(submit(batch))
+        collect(wait(pending).done)
+
+    report['Errors'].sort(key=lambda e: e['line'])
+    seconds = time.time() - start
+    report['Seconds'] = round(seconds, 3)
+    report['RowsPerSecond'] = round(report['Rows'] / seconds, 1) if seconds else None
+    if report['Imported']:
+        bump_version(table_name)
+    return report
+
+
+def handle_import_request(entity, event):
+    """POST /{clients,addresses,products}/import"""
+    try:
+        params = event.get('queryStringParameters') or {}
+        headers = {k.lower(): v for k, v in (event.get('headers') or {}).items()}
+
+        if params.get('key'):
+            bucket = params.get('bucket', IMPORT_BUCKET)
+            if not bucket:
+                return {'statusCode': 400, 'body': json.dumps({'error': 'Missing import bucket'})}
+            fmt = params.get('format') or detect_format(params['key'])
+            stream = open_s3(bucket, params['key'])
+        elif event.get('body'):
+            fmt = params.get('format') or ('csv' if 'csv' in headers.get('content-type', '') else 'ndjson')
+            body = event['body']
+            if event.get('isBase64Encoded'):
+                stream = open_text(io.BytesIO(base64.b64decode(body)), False)
+            else:
+                stream = io.StringIO(body.lstrip('\ufeff'), newline='')
+        else:
+            return {'statusCode': 400, 'body': json.dumps({'error': 'Missing import body or key'})}
+        if fmt not in ('ndjson', 'csv'):
+            return {'statusCode': 400, 'body': json.dumps({'error': 'format must be ndjson or csv'})}
+
+        with stream:
+            report = import_rows(entity, read_rows(stream, fmt))
+        metrics.put('ImportedRows', report['Imported'], Entity=entity)
+        metrics.put('ImportRejectedRows', report['Failed'], Entity=entity)
+        return {'statusCode': 200, 'body': json.dumps(report)}
+
+    except Exception as e:
+        return {'statusCode': 500, 'body': json.dumps({'error': str(e)})}
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Bulk import a catalog from NDJSON or CSV')
+    parser.add_argument('entity', choices=sorted(RESOURCES))
+    parser.add_argument('source', help='S3 key, or a local path with --local')
+    parser.add_argument('--bucket', default=IMPORT_BUCKET)
+    parser.add_argument('--local', action='store_true')
+    parser.add_argument('--format', choices=['ndjson', 'csv'])
+    parser.add_argument('--workers', type=int, default=IMPORT_WORKERS)
+    args = parser.parse_args()
+    if args.local:
+        stream = open_text(open(args.source, 'rb'), args.source.endswith('.gz'))
+    else:
+        if not args.bucket:
+            parser.error('--bucket (or IMPORT_BUCKET) is required for S3 sources')
+        stream = open_s3(args.bucket, args.source)
+    with stream:
+        print(json.dumps(import_rows(args.entity, read_rows(stream, args.format or detect_format(args.source)), args.workers)))
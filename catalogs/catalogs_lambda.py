@@ -1,239 +1,329 @@
+import base64
 import json
-import boto3
+import aws
+import metrics
+from metrics import instrumented
 import uuid
-import os
-import time
-from decimal import Decimal
+from functools import partial
+from boto3.dynamodb.conditions import Attr, Key
+from boto3.dynamodb.types import DYNAMODB_CONTEXT
+from botocore.exceptions import ClientError
+from aws import lazy
+from router import Router
+from json_encoding import dumps
+from cache import bump_version, get_cache, sync_versions
+import unique_keys
 
-dynamodb = boto3.resource('dynamodb')
-clients_table = dynamodb.Table('Clients')
-addresses_table = dynamodb.Table('Addresses')
-products_table = dynamodb.Table('Products')
+dynamodb = lazy(lambda: aws.resource('dynamodb'))
+clients_table = lazy(lambda: dynamodb.Table('Clients'))
+addresses_table = lazy(lambda: dynamodb.Table('Addresses'))
+products_table = lazy(lambda: dynamodb.Table('Products'))
 
-cloudwatch = boto3.client("cloudwatch")
-ENV = os.getenv("ENVIRONMENT", "local")
-def instrumented(handler):
-    def wrapper(event, context):
-        start = time.time()
+# read-through caches for warm containers; PUT/DELETE bump the table's version stamp
+clients_cache = get_cache('Clients')
+addresses_cache = get_cache('Addresses')
+products_cache = get_cache('Products')
 
-        try:
-            response = handler(event, context)
-        except Exception as e:
-            send_metric("HTTP_5XX", 1)
-            raise
+CLIENT_FIELDS = ['RazonSocial', 'NombreComercial', 'RFC', 'CorreoElectronico', 'Telefono']
+ADDRESS_FIELDS = ['Domicilio', 'Colonia', 'Municipio', 'Estado', 'TipoDireccion']
+PRODUCT_FIELDS = ['Nombre', 'UnidadMedida', 'PrecioBase']
+ADDRESS_TYPES = ('Facturacion', 'Envio')
+# same name as CLIENTS_RFC_INDEX in sales/schema.py
+RFC_INDEX = 'RFC-index'
 
-        duration = (time.time() - start) * 1000
+DEFAULT_PAGE_SIZE = 100
+MAX_PAGE_SIZE = 1000
+# a filtered list evaluates at least this many items per scan call, and
+# returns a short page with its cursor after MAX_SCAN_CALLS calls
+FILTER_SCAN_SIZE = 1000
+MAX_SCAN_CALLS = 5
 
-        status = response.get("statusCode", 200)
-        if 200 <= status < 300:
-            send_metric("HTTP_2XX", 1)
-        elif 400 <= status < 500:
-            send_metric("HTTP_4XX", 1)
-        else:
-            send_metric("HTTP_5XX", 1)
+def validate_address(body):
+    if body['TipoDireccion'] not in ADDRESS_TYPES:
+        return 'Address type must be either Facturacion or Envio'
 
-        send_metric("LatencyMs", duration, unit="Milliseconds")
+def normalize_rfc(rfc):
+    return str(rfc).strip().upper()
 
-        return response
+def parse_precio(value):
+    # DynamoDB's context traps values it cannot store exactly (over 38
+    # digits, exponents out of range); NaN and Infinity are not numbers to it
+    return DYNAMODB_CONTEXT.create_decimal(str(value))
 
-    return wrapper
+def validate_product(body):
+    try:
+        if parse_precio(body['PrecioBase']).is_finite():
+            return None
+    except ArithmeticError:
+        pass
+    return f"Invalid PrecioBase: {body['PrecioBase']}"
 
+# One entry per catalog; each gets POST/GET/PUT/DELETE routes plus a bulk import.
+#   fields     required on POST and PUT, in the order they are stored
+#   validate   body -> error message or None, after the required-field check
+#   convert    field -> function applied to the value before it is stored
+#   filters    list query parameter -> condition builder
+#   unique     field no two items may share, guarded in unique_keys
+#   missing    response of GET /{path}/{id} for an unknown ID
+RESOURCES = {
+    'clients': {
+        'name': 'Client',
+        'table': clients_table,
+        'cache': clients_cache,
+        'fields': CLIENT_FIELDS,
+        'convert': {'RFC': normalize_rfc},
+        'filters': {'razon_social': lambda v: Attr('RazonSocial').begins_with(v)},
+        'unique': 'RFC',
+        'missing': {'statusCode': 404, 'body': json.dumps({'error': 'Client not found'})},
+    },
+    'addresses': {
+        'name': 'Address',
+        'table': addresses_table,
+        'cache': addresses_cache,
+        'fields': ADDRESS_FIELDS,
+        'validate': validate_address,
+        'filters': {'tipo': lambda v: Attr('TipoDireccion').eq(v)},
+    },
+    'products': {
+        'name': 'Product',
+        'table': products_table,
+        'cache': products_cache,
+        'fields': PRODUCT_FIELDS,
+        'validate': validate_product,
+        'convert': {'PrecioBase': parse_precio},
+        'filters': {'nombre': lambda v: Attr('Nombre').begins_with(v)},
+    },
+}
 
 def send_metric(name, value, unit="Count"):
-    cloudwatch.put_metric_data(
-        Namespace=f"MyApp-{ENV}",
-        MetricData=[
-            {
-                "MetricName": name,
-                "Value": value,
-                "Unit": unit
-            }
-        ]
-    )
+    metrics.put(name, value, unit)
+
+router = Router()
 
 @instrumented
 def lambda_handler(event, context):
-    http_method = event.get("requestContext", {}).get("http", {}).get("method")
-    path = event.get("routeKey", "")
-    body = json.loads(event.get('body', '{}')) if event.get('body') else {}
-
+    sync_versions()
     try:
-        if '/clients' in path:
-            if http_method == 'POST':
-                required_fields = ['RazonSocial', 'NombreComercial', 'RFC', 'CorreoElectronico', 'Telefono']
-                if not all(field in body for field in required_fields):
-                    return {'statusCode': 400, 'body': json.dumps({'error': 'Missing required fields: ' + ', '.join([f for f in required_fields if f not in body])})}
-
-                client_id = str(uuid.uuid4())
-                clients_table.put_item(Item={
-                    'ID': client_id,
-                    'RazonSocial': body['RazonSocial'],
-                    'NombreComercial': body['NombreComercial'],
-                    'RFC': body['RFC'],
-                    'CorreoElectronico': body['CorreoElectronico'],
-                    'Telefono': body['Telefono']
-                })
-                return {'statusCode': 200, 'body': json.dumps({'ID': client_id})}
-            
-            elif http_method == 'GET':
-                client_id = event.get('pathParameters', {}).get('id')
-                if client_id:
-                    response = clients_table.get_item(Key={'ID': client_id})
-                    if not response.get('Item'):
-                        return {'statusCode': 404, 'message': "Client not found"}
-                    return {'statusCode': 200, 'body': json.dumps(response.get('Item', {}))}
-                else:
-                    response = clients_table.scan()
-                    return {'statusCode': 200, 'body': json.dumps(response['Items'])}
-            
-            elif http_method == 'PUT':
-                client_id = event.get('pathParameters', {}).get('id')
-                if not client_id:
-                     return {'statusCode': 400, 'body': json.dumps({'error': 'Missing ID in path'})}
-
-                required_fields = ['RazonSocial', 'NombreComercial', 'RFC', 'CorreoElectronico', 'Telefono']
-                if not all(field in body for field in required_fields):
-                    return {'statusCode': 400, 'body': json.dumps({'error': 'Missing required fields: ' + ', '.join([f for f in required_fields if f not in body])})}
-
-                clients_table.update_item(
-                    Key={'ID': client_id},
-                    UpdateExpression='SET RazonSocial = :rs, NombreComercial = :nc, RFC = :rfc, CorreoElectronico = :ce, Telefono = :tel',
-                    ExpressionAttributeValues={
-                        ':rs': body['RazonSocial'],
-                        ':nc': body['NombreComercial'],
-                        ':rfc': body['RFC'],
-                        ':ce': body['CorreoElectronico'],
-                        ':tel': body['Telefono']
-                    }
-                )
-                return {'statusCode': 200, 'body': json.dumps({'message': 'Client updated'})}
-            
-            elif http_method == 'DELETE':
-                client_id = event.get('pathParameters', {}).get('id')
-                if not client_id:
-                     return {'statusCode': 400, 'body': json.dumps({'error': 'Missing ID in path'})}
-                clients_table.delete_item(Key={'ID': client_id})
-                return {'statusCode': 200, 'body': json.dumps({'message': 'Client deleted'})}
-
-        elif '/addresses' in path:
-            if http_method == 'POST':
-                required_fields = ['Domicilio', 'Colonia', 'Municipio', 'Estado', 'TipoDireccion']
-                if not all(field in body for field in required_fields):
-                    return {'statusCode': 400, 'body': json.dumps({'error': 'Missing required fields: ' + ', '.join([f for f in required_fields if f not in body])})}
-                if body['TipoDireccion'] != 'Facturacion' and body['TipoDireccion'] != 'Envio':
-                    return {'statusCode': 400, 'body': 'Address type must be either Facturacion or Envio'}
-                address_id = str(uuid.uuid4())
-                addresses_table.put_item(Item={
-                    'ID': address_id,
-                    'Domicilio': body['Domicilio'],
-                    'Colonia': body['Colonia'],
-                    'Municipio': body['Municipio'],
-                    'Estado': body['Estado'],
-                    'TipoDireccion': body['TipoDireccion']
-                })
-                return {'statusCode': 200, 'body': json.dumps({'ID': address_id})}
-            
-            elif http_method == 'GET':
-                address_id = event.get('pathParameters', {}).get('id')
-                if address_id:
-                    response = addresses_table.get_item(Key={'ID': address_id})
-                    return {'statusCode': 200, 'body': json.dumps(response.get('Item', {}))}
-                else:
-                    response = addresses_table.scan()
-                    return {'statusCode': 200, 'body': json.dumps(response['Items'])}
-            
-            elif http_method == 'PUT':
-                address_id = event.get('pathParameters', {}).get('id')
-                if not address_id:
-                     return {'statusCode': 400, 'body': json.dumps({'error': 'Missing ID in path'})}
-
-                required_fields = ['Domicilio', 'Colonia', 'Municipio', 'Estado', 'TipoDireccion']
-                if not all(field in body for field in required_fields):
-                    return {'statusCode': 400, 'body': json.dumps({'error': 'Missing required fields: ' + ', '.join([f for f in required_fields if f not in body])})}
-                if body['TipoDireccion'] != 'Facturacion' and body['TipoDireccion'] != 'Envio':
-                    return {'statusCode': 400, 'body': 'Address type must be either Facturacion or Envio'}
-
-                addresses_table.update_item(
-                    Key={'ID': address_id},
-                    UpdateExpression='SET Domicilio = :d, Colonia = :c, Municipio = :m, Estado = :e, TipoDireccion = :td',
-                    ExpressionAttributeValues={
-                        ':d': body['Domicilio'],
-                        ':c': body['Colonia'],
-                        ':m': body['Municipio'],
-                        ':e': body['Estado'],
-                        ':td': body['TipoDireccion']
-                    }
-                )
-                return {'statusCode': 200, 'body': json.dumps({'message': 'Address updated'})}
-            
-            elif http_method == 'DELETE':
-                address_id = event.get('pathParameters', {}).get('id')
-                if not address_id:
-                     return {'statusCode': 400, 'body': json.dumps({'error': 'Missing ID in path'})}
-                addresses_table.delete_item(Key={'ID': address_id})
-                return {'statusCode': 200, 'body': json.dumps({'message': 'Address deleted'})}
-
-        elif '/products' in path:
-            if http_method == 'POST':
-                required_fields = ['Nombre', 'UnidadMedida', 'PrecioBase']
-                if not all(field in body for field in required_fields):
-                    return {'statusCode': 400, 'body': json.dumps({'error': 'Missing required fields: ' + ', '.join([f for f in required_fields if f not in body])})}
-
-                product_id = str(uuid.uuid4())
-                products_table.put_item(Item={
-                    'ID': product_id,
-                    'Nombre': body['Nombre'],
-                    'UnidadMedida': body['UnidadMedida'],
-                    'PrecioBase': Decimal(str(body['PrecioBase']))
-                })
-                return {'statusCode': 200, 'body': json.dumps({'ID': product_id})}
-            
-            elif http_method == 'GET':
-                product_id = event.get('pathParameters', {}).get('id')
-                if product_id:
-                    response = products_table.get_item(Key={'ID': product_id})
-                    return {'statusCode': 200, 'body': json.dumps(decimal_to_native(response.get('Item', {})))}
-                else:
-                    response = products_table.scan()
-                    return {'statusCode': 200, 'body': json.dumps(decimal_to_native(response['Items']))}
-            
-            elif http_method == 'PUT':
-                product_id = event.get('pathParameters', {}).get('id')
-                if not product_id:
-                     return {'statusCode': 400, 'body': json.dumps({'error': 'Missing ID in path'})}
-
-                required_fields = ['Nombre', 'UnidadMedida', 'PrecioBase']
-                if not all(field in body for field in required_fields):
-                    return {'statusCode': 400, 'body': json.dumps({'error': 'Missing required fields: ' + ', '.join([f for f in required_fields if f not in body])})}
-
-                products_table.update_item(
-                    Key={'ID': product_id},
-                    UpdateExpression='SET Nombre = :n, UnidadMedida = :um, PrecioBase = :pb',
-                    ExpressionAttributeValues={
-                        ':n': body['Nombre'],
-                        ':um': body['UnidadMedida'],
-                        ':pb': Decimal(str(body['PrecioBase']))
-                    }
-                )
-                return {'statusCode': 200, 'body': json.dumps({'message': 'Product updated'})}
-            
-            elif http_method == 'DELETE':
-                product_id = event.get('pathParameters', {}).get('id')
-                if not product_id:
-                     return {'statusCode': 400, 'body': json.dumps({'error': 'Missing ID in path'})}
-                products_table.delete_item(Key={'ID': product_id})
-                return {'statusCode': 200, 'body': json.dumps({'message': 'Product deleted'})}
-
-        return {'statusCode': 400, 'body': json.dumps({'error': 'Invalid path or method'})}
-
+        return router.dispatch(event, context)
     except Exception as e:
         return {'statusCode': 500, 'body': json.dumps({'error': str(e)})}
 
-def decimal_to_native(obj):
-    if isinstance(obj, list):
-        return [decimal_to_native(i) for i in obj]
-    elif isinstance(obj, dict):
-        return {k: decimal_to_native(v) for k, v in obj.items()}
-    elif isinstance(obj, Decimal):
-        return int(obj) if obj % 1 == 0 else float(obj)
-    return obj
+def item_values(resource, body):
+    """Validate a POST/PUT body; returns (values to store, error message)."""
+    validate = resource.get('validate')
+    error = validate(body) if validate else None
+    if error:
+        return None, error
+    convert = resource.get('convert', {})
+    return {field: convert.get(field, lambda v: v)(body[field]) for field in resource['fields']}, None
+
+def create_resource(resource, event, params, body):
+    values, error = item_values(resource, body)
+    if error:
+        return {'statusCode': 400, 'body': json.dumps({'error': error})}
+    item_id = str(uuid.uuid4())
+    item = dict({'ID': item_id}, **values)
+    if resource.get('unique'):
+        conflict = guarded_write(resource, item_id, {'Put': {
+            'TableName': resource['table'].name,
+            'Item': item,
+            'ConditionExpression': 'attribute_not_exists(ID)'
+        }}, item[resource['unique']])
+        if conflict:
+            return conflict
+    else:
+        resource['table'].put_item(Item=item)
+    return {'statusCode': 200, 'body': json.dumps({'ID': item_id})}
+
+def read_resource(resource, event, params, body):
+    item = get_item(resource['table'], resource['cache'], params['id'])
+    if not item and 'missing' in resource:
+        return resource['missing']
+    return {'statusCode': 200, 'body': dumps(item or {})}
+
+def list_resource(resource, event, params, body):
+    return list_items(resource['table'], event, resource['filters'])
+
+def update_resource(resource, event, params, body):
+    values, error = item_values(resource, body)
+    if error:
+        return {'statusCode': 400, 'body': json.dumps({'error': error})}
+    names = list(values)
+    update = {
+        'Key': {'ID': params['id']},
+        'UpdateExpression': 'SET ' + ', '.join(f'#f{i} = :f{i}' for i in range(len(names))),
+        'ExpressionAttributeNames': {f'#f{i}': name for i, name in enumerate(names)},
+        'ExpressionAttributeValues': {f':f{i}': values[name] for i, name in enumerate(names)}
+    }
+    if resource.get('unique'):
+        current = resource['table'].get_item(Key={'ID': params['id']}, ConsistentRead=True).get('Item')
+        condition, condition_names, condition_values = unchanged_condition(resource, current)
+        update['TableName'] = resource['table'].name
+        update['ConditionExpression'] = condition
+        update['ExpressionAttributeNames'].update(condition_names)
+        update['ExpressionAttributeValues'].update(condition_values)
+        conflict = guarded_write(resource, params['id'], {'Update': update}, values[resource['unique']], current)
+        if conflict:
+            return conflict
+    else:
+        resource['table'].update_item(**update)
+    bump_version(resource['table'].name)
+    return {'statusCode': 200, 'body': json.dumps({'message': f"{resource['name']} updated"})}
+
+def delete_resource(resource, event, params, body):
+    current = None
+    if resource.get('unique'):
+        current = resource['table'].get_item(Key={'ID': params['id']}, ConsistentRead=True).get('Item')
+    if current:
+        condition, condition_names, condition_values = unchanged_condition(resource, current)
+        delete = {'TableName': resource['table'].name, 'Key': {'ID': params['id']}, 'ConditionExpression': condition}
+        if condition_names:
+            delete['ExpressionAttributeNames'] = condition_names
+        if condition_values:
+            delete['ExpressionAttributeValues'] = condition_values
+        conflict = guarded_write(resource, params['id'], {'Delete': delete}, None, current)
+        if conflict:
+            return conflict
+    else:
+        resource['table'].delete_item(Key={'ID': params['id']})
+    bump_version(resource['table'].name)
+    return {'statusCode': 200, 'body': json.dumps({'message': f"{resource['name']} deleted"})}
+
+def unchanged_condition(resource, current):
+    """(condition, names, values) that the item still holds the unique value read in current."""
+    if not current:
+        return 'attribute_not_exists(ID)', {}, {}
+    if resource['unique'] not in current:
+        return 'attribute_exists(ID) AND attribute_not_exists(#u)', {'#u': resource['unique']}, {}
+    return '#u = :u', {'#u': resource['unique']}, {':u': current[resource['unique']]}
+
+def guarded_write(resource, item_id, operation, value, current=None):
+    """Write an item in one transaction with the guards of its unique field.
+
+    operation is the TransactWriteItems entry of the item itself, conditioned
+    on the item still being as read in current. value is the unique value
+    the item holds afterwards (None when it is deleted). Returns None, or the
+    409 response when another item holds value or the item changed meanwhile.
+    """
+    field = resource['unique']
+    old_value = (current or {}).get(field)
+    transact_items = [operation]
+    if value is not None and value != old_value:
+        transact_items.append(unique_keys.claim(field, value, item_id))
+    if old_value is not None and old_value != value:
+        transact_items.append(unique_keys.release(field, old_value, item_id))
+    try:
+        dynamodb.meta.client.transact_write_items(TransactItems=transact_items)
+    except ClientError as e:
+        failed = unique_keys.failed_checks(e)
+        if not failed:
+            raise
+        if failed[0] == 0:
+            return {'statusCode': 409, 'body': json.dumps({'error': f"{resource['name']} {item_id} was changed by another request, try again"})}
+        if transact_items[failed[0]].get('Put'):
+            return {'statusCode': 409, 'body': json.dumps({'error': f'{field} {value} is already registered'})}
+        return {'statusCode': 409, 'body': json.dumps({'error': f'{field} {old_value} is registered to another item'})}
+    return None
+
+def read_by_rfc(event, params, body):
+    rfc = normalize_rfc(params['rfc'])
+    response = clients_table.query(IndexName=RFC_INDEX, KeyConditionExpression=Key('RFC').eq(rfc), Limit=1)
+    if not response['Items']:
+        return {'statusCode': 404, 'body': json.dumps({'error': f'No client with RFC {rfc}'})}
+    return {'statusCode': 200, 'body': dumps(response['Items'][0])}
+
+def import_resource(path, event, params, body):
+    # the body is NDJSON or CSV, so the module is only loaded for this route
+    import catalogs_import
+    return catalogs_import.handle_import_request(path, event)
+
+for path, resource in RESOURCES.items():
+    router.add('POST', f'/{path}', partial(create_resource, resource), required=resource['fields'])
+    router.add('GET', f'/{path}', partial(list_resource, resource))
+    router.add('GET', f'/{path}/{{id}}', partial(read_resource, resource))
+    router.add('PUT', f'/{path}/{{id}}', partial(update_resource, resource), required=resource['fields'])
+    router.add('DELETE', f'/{path}/{{id}}', partial(delete_resource, resource))
+    router.add('POST', f'/{path}/import', partial(import_resource, path), raw_body=True)
+router.add('GET', '/clients/rfc/{rfc}', read_by_rfc)
+
+def get_item(table, cache, item_id):
+    return cache.get_or_load(item_id, lambda key: table.get_item(Key={'ID': key}).get('Item'))
+
+def list_items(table, event, filters):
+    """Return one page of a table scan.
+
+    Query parameters: limit (page size), next (cursor from the previous
+    page), fields (comma-separated projection) and the filters declared by
+    the caller, each mapping a parameter name to a condition builder.
+
+    A page has at most limit items. With a sparse filter it can be shorter,
+    or empty, while next is still set: the scan stops after MAX_SCAN_CALLS
+    calls so one request never reads the whole table.
+    """
+    params = event.get('queryStringParameters') or {}
+    try:
+        limit = int(params.get('limit', DEFAULT_PAGE_SIZE))
+    except ValueError:
+        return {'statusCode': 400, 'body': json.dumps({'error': 'limit must be an integer'})}
+    if limit < 1:
+        return {'statusCode': 400, 'body': json.dumps({'error': 'limit must be positive'})}
+    limit = min(limit, MAX_PAGE_SIZE)
+
+    scan_kwargs = {}
+    if params.get('next'):
+        try:
+            scan_kwargs['ExclusiveStartKey'] = decode_cursor(params['next'])
+        except ValueError:
+            return {'statusCode': 400, 'body': json.dumps({'error': 'Invalid next token'})}
+    fields = None
+    if params.get('fields'):
+        fields = [f.strip() for f in params['fields'].split(',') if f.strip()]
+        # the ID is always read: a page cut short resumes after its last item
+        projection = fields if 'ID' in fields else fields + ['ID']
+        scan_kwargs['ProjectionExpression'] = ', '.join(f'#f{i}' for i in range(len(projection)))
+        scan_kwargs['ExpressionAttributeNames'] = {f'#f{i}': field for i, field in enumerate(projection)}
+    conditions = [build(params[name]) for name, build in filters.items() if params.get(name)]
+    if conditions:
+        filter_expression = conditions[0]
+        for condition in conditions[1:]:
+            filter_expression = filter_expression & condition
+        scan_kwargs['FilterExpression'] = filter_expression
+
+    # Limit caps items evaluated, not matched: a filter needs bigger scans
+    scan_kwargs['Limit'] = max(limit, FILTER_SCAN_SIZE) if conditions else limit
+    items = []
+    for _ in range(MAX_SCAN_CALLS):
+        response = table.scan(**scan_kwargs)
+        page = response['Items']
+        last_key = response.get('LastEvaluatedKey')
+        if len(items) + len(page) > limit:
+            # more matches than fit: the next page starts after the last one returned
+            page = page[:limit - len(items)]
+            last_key = {'ID': page[-1]['ID']}
+        items.extend(page)
+        if not last_key or len(items) >= limit:
+            break
+        scan_kwargs['ExclusiveStartKey'] = last_key
+    if fields and 'ID' not in fields:
+        for item in items:
+            del item['ID']
+
+    return {
+        'statusCode': 200,
+        'body': dumps({
+            'Items': items,
+            'next': encode_cursor(last_key) if last_key else None
+        })
+    }
+
+def encode_cursor(key):
+    return base64.urlsafe_b64encode(dumps(key).encode('utf-8')).decode('ascii')
+
+def decode_cursor(token):
+    try:
+        key = json.loads(base64.urlsafe_b64decode(token.encode('ascii')))
+    except (ValueError, TypeError):
+        raise ValueError('Invalid cursor')
+    if not isinstance(key, dict):
+        raise ValueError('Invalid cursor')
+    return key
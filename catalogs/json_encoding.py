@@ -0,0 +1,46 @@
+import os
+from decimal import Decimal
+
+import simplejson
+
+# Each Lambda image only contains its own directory, so this module is
+# copied verbatim into catalogs/ and sales/.
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+# orjson.Fragment (3.9+) is what lets orjson write a Decimal's digits as is
+if orjson is not None and not hasattr(orjson, 'Fragment'):
+    orjson = None
+
+# auto: orjson when a recent enough one is installed, else simplejson
+JSON_BACKEND = os.getenv('JSON_BACKEND', 'auto')
+
+
+def _default(value):
+    if isinstance(value, (set, frozenset)):
+        # DynamoDB string and number sets
+        return list(value)
+    if isinstance(value, (bytes, bytearray)):
+        return value.decode('utf-8')
+    raise TypeError(f'Object of type {type(value).__name__} is not JSON serializable')
+
+
+def _orjson_default(value):
+    if isinstance(value, Decimal):
+        return orjson.Fragment(str(value))
+    return _default(value)
+
+
+def dumps(obj):
+    """Serialize DynamoDB items in one pass, without copying them first.
+
+    Every DynamoDB number is written as a JSON number with exactly its stored
+    digits (1523.30 stays 1523.30), never rounded through a float or turned
+    into a string, whatever its size.
+    """
+    if orjson is not None and JSON_BACKEND != 'json':
+        return orjson.dumps(obj, default=_orjson_default).decode('utf-8')
+    return simplejson.dumps(obj, use_decimal=True, default=_default)
@@ -0,0 +1,90 @@
+import base64
+import json
+import re
+
+# Each Lambda image only contains its own directory, so this module is
+# copied verbatim into catalogs/ and sales/.
+
+
+def error(status, message):
+    return {'statusCode': status, 'body': json.dumps({'error': message})}
+
+
+class Router:
+    """Dispatch table for API Gateway HTTP API events and direct invocations.
+
+    Routes are keyed on (method, path template), e.g. ('GET', '/clients/{id}'),
+    which is exactly what API Gateway puts in routeKey, so a request costs one
+    dict lookup. Events from a $default route only carry rawPath; those are
+    matched against the templates of their method instead.
+
+    Handlers are called as handler(event, params, body), with the path
+    parameters and the parsed JSON body (None for raw_body routes).
+    """
+
+    def __init__(self):
+        self.routes = {}
+        self.patterns = {}
+        self.actions = {}
+
+    def add(self, method, template, handler, required=None, raw_body=False):
+        if (method, template) in self.routes:
+            raise ValueError(f'Route {method} {template} is already registered')
+        self.routes[(method, template)] = (handler, required or [], raw_body)
+        pattern = re.sub(r'\\\{(\w+)\\\}', r'(?P<\1>[^/]+)', re.escape(template))
+        self.patterns.setdefault(method, []).append((re.compile(pattern + '$'), template))
+
+    def route(self, method, template, required=None, raw_body=False):
+        def decorator(handler):
+            self.add(method, template, handler, required, raw_body)
+            return handler
+        return decorator
+
+    def action(self, name):
+        """Register a handler(event, context) for direct invocations with {"action": name}."""
+        def decorator(handler):
+            self.actions[name] = handler
+            return handler
+        return decorator
+
+    def resolve(self, event):
+        """Return ((handler, required, raw_body), path parameters), or (None, None)."""
+        route_key = event.get('routeKey', '')
+        if ' ' in route_key:
+            entry = self.routes.get(tuple(route_key.split(' ', 1)))
+            if entry:
+                return entry, event.get('pathParameters') or {}
+        method = event.get('requestContext', {}).get('http', {}).get('method')
+        raw_path = event.get('rawPath', '')
+        for pattern, template in self.patterns.get(method, ()):
+            match = pattern.match(raw_path)
+            if match:
+                return self.routes[(method, template)], match.groupdict()
+        return None, None
+
+    def dispatch(self, event, context=None):
+        if event.get('action') in self.actions:
+            return self.actions[event['action']](event, context)
+
+        entry, params = self.resolve(event)
+        if not entry:
+            return error(400, 'Invalid path or method')
+        handler, required, raw_body = entry
+        if raw_body:
+            return handler(event, params, None)
+
+        body = {}
+        if event.get('body'):
+            raw = event['body']
+            if event.get('isBase64Encoded'):
+                raw = base64.b64decode(raw)
+            try:
+                body = json.loads(raw)
+            except ValueError:
+                return error(400, 'Invalid JSON body')
+            if not isinstance(body, dict):
+                return error(400, 'Body must be a JSON object')
+        missing = [field for field in required if field not in body]
+        if missing:
+            return error(400, 'Missing required fields: ' + ', '.join(missing))
+        return handler(event, params, body)
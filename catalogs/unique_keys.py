@@ -0,0 +1,95 @@
+"""Uniqueness of non-key attributes (client RFC, note Folio) via guard items.
+
+A GSI cannot reject duplicates, so every unique value also owns one item
+of the UniqueKeys table, ID '<attribute>#<value>', written in the same
+transaction as the item that holds the value:
+
+    claim(...)    Put that fails when another item already holds the value
+    release(...)  Delete of the guard of a value the item no longer holds
+
+Guards of items written before this existed are created with
+
+    python unique_keys.py Clients RFC
+    python unique_keys.py SalesNotes Folio
+
+which reports the values that are already duplicated.
+"""
+import argparse
+import json
+
+from botocore.exceptions import ClientError
+
+import aws
+
+# Each Lambda image only contains its own directory, so this module is
+# copied verbatim into catalogs/ and sales/.
+
+UNIQUE_KEYS_TABLE = 'UniqueKeys'
+
+
+def guard_id(attribute, value):
+    return f'{attribute}#{value}'
+
+
+def claim(attribute, value, owner_id):
+    """TransactWriteItems Put reserving value for owner_id."""
+    return {'Put': {
+        'TableName': UNIQUE_KEYS_TABLE,
+        'Item': {'ID': guard_id(attribute, value), 'Propietario': owner_id},
+        'ConditionExpression': 'attribute_not_exists(ID) OR Propietario = :owner',
+        'ExpressionAttributeValues': {':owner': owner_id}
+    }}
+
+
+def release(attribute, value, owner_id):
+    """TransactWriteItems Delete of owner_id's guard for value."""
+    return {'Delete': {
+        'TableName': UNIQUE_KEYS_TABLE,
+        'Key': {'ID': guard_id(attribute, value)},
+        'ConditionExpression': 'attribute_not_exists(ID) OR Propietario = :owner',
+        'ExpressionAttributeValues': {':owner': owner_id}
+    }}
+
+
+def failed_checks(error):
+    """Indexes of the operations whose condition failed in a cancelled transaction.
+
+    Re-raises any other error.
+    """
+    if error.response['Error']['Code'] != 'TransactionCanceledException':
+        raise error
+    reasons = error.response.get('CancellationReasons', [])
+    return [i for i, reason in enumerate(reasons) if reason.get('Code') == 'ConditionalCheckFailed']
+
+
+def backfill(table_name, attribute):
+    """Claim the value of every item of table_name; returns {value: [IDs of the items not claimed]}."""
+    dynamodb = aws.resource('dynamodb')
+    table = dynamodb.Table(table_name)
+    guards = dynamodb.Table(UNIQUE_KEYS_TABLE)
+    duplicates = {}
+    scan_kwargs = {'ProjectionExpression': 'ID, #u', 'ExpressionAttributeNames': {'#u': attribute}}
+    while True:
+        response = table.scan(**scan_kwargs)
+        for item in response['Items']:
+            if attribute not in item:
+                continue
+            put = claim(attribute, item[attribute], item['ID'])['Put']
+            del put['TableName']
+            try:
+                guards.put_item(**put)
+            except ClientError as e:
+                if e.response['Error']['Code'] != 'ConditionalCheckFailedException':
+                    raise
+                duplicates.setdefault(item[attribute], []).append(item['ID'])
+        if 'LastEvaluatedKey' not in response:
+            return duplicates
+        scan_kwargs['ExclusiveStartKey'] = response['LastEvaluatedKey']
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Create the guard items of existing unique values')
+    parser.add_argument('table')
+    parser.add_argument('attribute')
+    args = parser.parse_args()
+    print(json.dumps({'Duplicates': backfill(args.table, args.attribute)}))
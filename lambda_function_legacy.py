@@ -2,6 +2,7 @@ import json
 import boto3
 import uuid
 import base64
+import time
 from datetime import datetime
 from decimal import Decimal
 from reportlab.lib import colors
@@ -21,6 +22,7 @@ sales_notes_table = dynamodb.Table('SalesNotes')
 sales_note_items_table = dynamodb.Table('SalesNoteItems')
 
 BUCKET_NAME = '750924-esi3898k-examen1'
+BATCH_GET_LIMIT = 100
 
 def lambda_handler(event, context):
     http_method = event.get("requestContext", {}).get("http", {}).get("method")
@@ -200,7 +202,8 @@ def lambda_handler(event, context):
 
                 note = sales_notes_table.get_item(Key={'ID': note_id})['Item']
                 client = clients_table.get_item(Key={'ID': note['ClienteID']})['Item']
-                pdf_buffer = generate_pdf(client, note['Folio'], all_items)
+                products = resolve_products(i['ProductoID'] for i in all_items)
+                pdf_buffer = generate_pdf(client, note['Folio'], all_items, products)
 
                 s3_key = f"{client['RFC']}/{note['Folio']}.pdf"
                 try:
@@ -297,7 +300,25 @@ def lambda_handler(event, context):
     except Exception as e:
         return {'statusCode': 500, 'body': json.dumps({'error': str(e)})}
 
-def generate_pdf(client, folio, items):
+def resolve_products(product_ids, max_retries=5):
+    products = {}
+    keys = [{'ID': product_id} for product_id in dict.fromkeys(product_ids)]
+    for start in range(0, len(keys), BATCH_GET_LIMIT):
+        request_items = {'Products': {'Keys': keys[start:start + BATCH_GET_LIMIT]}}
+        attempt = 0
+        while request_items:
+            response = dynamodb.batch_get_item(RequestItems=request_items)
+            for product in response['Responses'].get('Products', []):
+                products[product['ID']] = product
+            request_items = response.get('UnprocessedKeys')
+            if request_items:
+                if attempt >= max_retries:
+                    raise Exception('Could not fetch products: unprocessed keys after retries')
+                time.sleep(0.05 * (2 ** attempt))
+                attempt += 1
+    return products
+
+def generate_pdf(client, folio, items, products):
     buffer = BytesIO()
     doc = SimpleDocTemplate(buffer, pagesize=letter)
     elements = []
@@ -322,7 +343,7 @@ def generate_pdf(client, folio, items):
 
     items_data = [['Cantidad', 'Producto', 'Precio Unitario', 'Importe']]
     for item in items:
-        product = products_table.get_item(Key={'ID': item['ProductoID']})['Item']
+        product = products[item['ProductoID']]
         items_data.append([
             str(item['Cantidad']),
             product['Nombre'],
@@ -1,91 +1,79 @@
 import json
-import time
-import boto3
 import os
+import time
+import aws
+import metrics
+from aws import lazy
+from metrics import instrumented
 
 
-sns = boto3.client('sns')
+sns = lazy(lambda: aws.client('sns'))
 TOPIC_ARN = 'arn:aws:sns:us-east-1:470813633828:Notas'
-cloudwatch = boto3.client("cloudwatch")
-ENV = os.getenv("ENVIRONMENT", "local")
-def instrumented(handler):
-    def wrapper(event, context):
-        start = time.time()
-
-        try:
-            response = handler(event, context)
-        except Exception as e:
-            send_metric("HTTP_5XX", 1)
-            raise
-
-        duration = (time.time() - start) * 1000
+PUBLISH_BATCH_LIMIT = 10
+# A folio notified less than this many seconds ago by this container is not
+# notified again: the message only links to the note's latest PDF.
+COALESCE_WINDOW_SECONDS = float(os.getenv('NOTIFY_COALESCE_SECONDS', '5'))
 
-        status = response.get("statusCode", 200)
-        if 200 <= status < 300:
-            send_metric("HTTP_2XX", 1)
-        elif 400 <= status < 500:
-            send_metric("HTTP_4XX", 1)
-        else:
-            send_metric("HTTP_5XX", 1)
-
-        send_metric("LatencyMs", duration, unit="Milliseconds")
-
-        return response
-
-    return wrapper
+_recently_sent = {}
 
+INVALID_PAYLOAD = 'Invalid payload: expected a JSON object with a folio'
 
 def send_metric(name, value, unit="Count"):
-    cloudwatch.put_metric_data(
-        Namespace=f"MyApp-{ENV}",
-        MetricData=[
-            {
-                "MetricName": name,
-                "Value": value,
-                "Unit": unit
-            }
-        ]
-    )
+    metrics.put(name, value, unit)
 
 @instrumented
 def lambda_handler(event, context):
     """
     Handler for sending email notifications.
-    Expected event payload:
+    Accepts one payload, a list of payloads, or an SQS batch of payloads:
     {
         "client": { "RazonSocial": "..." },
         "folio": "...",
         "s3_link": "..."
     }
+    Payloads for the same folio are coalesced into one notification and
+    sent with publish_batch; a folio notified within the coalesce window is
+    not notified again and its payloads are reported as coalesced. Payloads
+    that are not JSON objects with a folio are reported as failed. SQS
+    batches report the records that failed in batchItemFailures so only
+    those are retried.
     """
     try:
-        payload = event
-        if 'body' in event:
-             try:
-                 payload = json.loads(event['body'])
-             except:
-                 pass
-
-        client_name = payload.get('client', {}).get('RazonSocial', 'Unknown Client')
-        folio = payload.get('folio', 'Unknown Folio')
-        s3_link = payload.get('s3_link', '')
-
-        message = {
-            'message': 'Nueva nota de venta creada o actualizada',
-            'client': client_name,
-            'folio': folio,
-            's3_link': s3_link
-        }
-
-        response = sns.publish(
-            TopicArn=TOPIC_ARN,
-            Message=json.dumps(message),
-            MessageGroupId=folio
-        )
+        if isinstance(event, dict) and 'Records' in event:
+            entries = [(record['messageId'], parse_payload(record.get('body'))) for record in event['Records']]
+            failed, _ = send_notifications(entries)
+            return {'batchItemFailures': [{'itemIdentifier': record_id} for record_id in failed]}
+
+        if isinstance(event, list):
+            entries = list(enumerate(parse_payload(payload) for payload in event))
+            failed, coalesced = send_notifications(entries)
+            return {
+                'statusCode': 207 if failed else 200,
+                'body': json.dumps({
+                    'sent': len(entries) - len(failed) - len(coalesced),
+                    'coalesced': len(coalesced),
+                    'failed': sorted(failed)
+                })
+            }
 
+        payload = parse_payload(event['body']) if 'body' in event else event
+        if not valid_payload(payload):
+            return {
+                'statusCode': 400,
+                'body': json.dumps({'error': INVALID_PAYLOAD})
+            }
+        results = {}
+        failed, coalesced = send_notifications([(0, payload)], results)
+        if failed:
+            raise Exception(results.get(0, 'Notification not sent'))
+        if coalesced:
+            return {
+                'statusCode': 200,
+                'body': json.dumps({'message': 'Notification coalesced', 'messageId': None})
+            }
         return {
             'statusCode': 200,
-            'body': json.dumps({'message': 'Notification sent', 'messageId': response.get('MessageId')})
+            'body': json.dumps({'message': 'Notification sent', 'messageId': results.get(0)})
         }
 
     except Exception as e:
@@ -94,3 +82,105 @@ def lambda_handler(event, context):
             'statusCode': 500,
             'body': json.dumps({'error': str(e)})
         }
+
+def parse_payload(body):
+    if isinstance(body, dict):
+        return body
+    try:
+        payload = json.loads(body)
+    except (TypeError, ValueError):
+        return None
+    return payload if isinstance(payload, dict) else None
+
+def valid_payload(payload):
+    return isinstance(payload, dict) and bool(payload.get('folio'))
+
+def build_message(payload):
+    return {
+        'message': 'Nueva nota de venta creada o actualizada',
+        'client': (payload.get('client') or {}).get('RazonSocial', 'Unknown Client'),
+        'folio': payload['folio'],
+        's3_link': payload.get('s3_link', '')
+    }
+
+def publish_entry(entry_id, folio, message, dedup_key=None):
+    entry = {'Id': str(entry_id), 'Message': json.dumps(message)}
+    # standard topics reject the FIFO-only ordering and deduplication fields
+    if TOPIC_ARN.endswith('.fifo'):
+        entry['MessageGroupId'] = folio
+        if dedup_key:
+            entry['MessageDeduplicationId'] = dedup_key
+    return entry
+
+def send_notifications(entries, results=None, coalesce=True):
+    """Publish one notification per folio for [(entry id, payload)].
+
+    Returns (failed, coalesced): the ids of the entries whose notification
+    was not sent, and of those skipped because their folio was notified
+    within the coalesce window. With coalesce=False the window is ignored
+    and every valid entry is published. Invalid payloads fail without being
+    published. When given, results maps entry ids to their SNS MessageId or
+    error. On a FIFO topic a payload's dedup_key, if any, becomes the
+    MessageDeduplicationId, so a redelivered payload is only published once.
+    """
+    results = {} if results is None else results
+    failed = []
+    # the last payload of each folio wins; dicts keep first-seen order
+    groups = {}
+    for entry_id, payload in entries:
+        if not valid_payload(payload):
+            failed.append(entry_id)
+            results[entry_id] = INVALID_PAYLOAD
+            continue
+        message = build_message(payload)
+        ids = groups.pop(message['folio'], (None, None, []))[2]
+        groups[message['folio']] = (message, payload.get('dedup_key'), ids + [entry_id])
+    send_metric('NotificationsCoalesced', len(entries) - len(failed) - len(groups))
+
+    now = time.monotonic()
+    pending = []
+    coalesced = []
+    for folio, (message, dedup_key, ids) in groups.items():
+        if coalesce and now - _recently_sent.get(folio, float('-inf')) < COALESCE_WINDOW_SECONDS:
+            coalesced.extend(ids)
+            continue
+        pending.append((folio, message, dedup_key, ids))
+    if coalesced:
+        send_metric('NotificationsCoalesced', len(coalesced))
+
+    sent = 0
+    for start in range(0, len(pending), PUBLISH_BATCH_LIMIT):
+        chunk = pending[start:start + PUBLISH_BATCH_LIMIT]
+        try:
+            response = sns.publish_batch(
+                TopicArn=TOPIC_ARN,
+                PublishBatchRequestEntries=[
+                    publish_entry(i, folio, message, dedup_key)
+                    for i, (folio, message, dedup_key, _) in enumerate(chunk)
+                ]
+            )
+            outcomes = {r['Id']: r['MessageId'] for r in response.get('Successful', [])}
+            errors = {r['Id']: r.get('Message') or r.get('Code') for r in response.get('Failed', [])}
+        except Exception as e:
+            print(f"Error publishing notifications: {e}")
+            outcomes = {}
+            errors = {str(i): str(e) for i in range(len(chunk))}
+
+        for i, (folio, _, _, ids) in enumerate(chunk):
+            if str(i) in outcomes:
+                sent += 1
+                _recently_sent[folio] = time.monotonic()
+                for entry_id in ids:
+                    results[entry_id] = outcomes[str(i)]
+            else:
+                failed.extend(ids)
+                for entry_id in ids:
+                    results[entry_id] = errors.get(str(i), 'Not published')
+
+    send_metric('NotificationsSent', sent)
+    if failed:
+        send_metric('NotificationsFailed', len(failed))
+    # forget folios outside the window so warm containers do not grow the map forever
+    for folio in [f for f, sent_at in _recently_sent.items() if now - sent_at >= COALESCE_WINDOW_SECONDS]:
+        del _recently_sent[folio]
+    return failed, coalesced
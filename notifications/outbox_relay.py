@@ -0,0 +1,143 @@
+"""Deliver the notifications the sales Lambda leaves in its outbox.
+
+Each sales note has one row in the NotificationsOutbox table. The item
+writes bump its Version and set Estado to 'esperando-pdf'; once the PDF is
+uploaded the row becomes 'pendiente' with the notification payload. This
+relay publishes pending rows in batches and marks them 'enviado'. Rows left
+'esperando-pdf' by a request that died before the upload are rendered again
+by the sales Lambda's scheduled sweep_outbox action.
+
+Delivery is at least once: a row is only marked after SNS accepted it, so
+a crash between the publish and the mark publishes the row again. On a FIFO
+topic the message carries folio:Version as its deduplication id and SNS
+drops that repeat; the Notas topic is a standard one, so there the client
+may get a second email. The mark is conditioned on the Version that was
+sent, so a note changed in the meantime stays pending and is notified again.
+
+Run it on a schedule (e.g. every minute) with lambda_handler as the entry
+point, or locally with `python outbox_relay.py`.
+"""
+import os
+import time
+from datetime import datetime
+
+from boto3.dynamodb.conditions import Key
+from botocore.exceptions import ClientError
+
+import aws
+import metrics
+from aws import lazy
+from notifications_lambda import send_notifications
+
+# same names as OUTBOX_TABLE and OUTBOX_INDEX in sales/schema.py
+OUTBOX_TABLE = 'NotificationsOutbox'
+OUTBOX_INDEX = 'Estado-index'
+RELAY_BATCH_SIZE = int(os.getenv('RELAY_BATCH_SIZE', '100'))
+# stop starting new batches when less than this is left of the invocation
+RELAY_RESERVE_MS = int(os.getenv('RELAY_RESERVE_MS', '10000'))
+# rows that fail this many times are parked as 'fallido' for inspection
+MAX_ATTEMPTS = int(os.getenv('RELAY_MAX_ATTEMPTS', '10'))
+
+outbox_table = lazy(lambda: aws.resource('dynamodb').Table(OUTBOX_TABLE))
+
+
+def fetch_pending(limit=RELAY_BATCH_SIZE):
+    response = outbox_table.query(
+        IndexName=OUTBOX_INDEX,
+        KeyConditionExpression=Key('Estado').eq('pendiente'),
+        Limit=limit
+    )
+    return response['Items']
+
+
+def dedup_key(row):
+    return f"{row['Payload']['folio']}:{row.get('Version', 0)}"
+
+
+def update_row(row, update_expression, values):
+    """Conditional update of a row still at the Version we read; False if it moved on."""
+    try:
+        outbox_table.update_item(
+            Key={'ID': row['ID']},
+            UpdateExpression=update_expression,
+            ConditionExpression='Version = :version AND Estado = :pendiente',
+            ExpressionAttributeValues=dict(values, **{':version': row.get('Version', 0), ':pendiente': 'pendiente'})
+        )
+        return True
+    except ClientError as e:
+        if e.response['Error']['Code'] != 'ConditionalCheckFailedException':
+            raise
+        return False
+
+
+def mark_sent(row):
+    return update_row(row, 'SET Estado = :enviado, EnviadoEn = :now, UltimaClave = :key REMOVE Intentos, UltimoError', {
+        ':enviado': 'enviado',
+        ':now': datetime.utcnow().isoformat(),
+        ':key': dedup_key(row)
+    })
+
+
+def mark_failed(row, error):
+    attempts = int(row.get('Intentos', 0)) + 1
+    return update_row(row, 'SET Estado = :estado, Intentos = :attempts, UltimoError = :error', {
+        ':estado': 'fallido' if attempts >= MAX_ATTEMPTS else 'pendiente',
+        ':attempts': attempts,
+        ':error': str(error)
+    })
+
+
+def relay_batch(limit=RELAY_BATCH_SIZE):
+    """Publish one batch of pending rows; returns (fetched, sent, failed)."""
+    rows = fetch_pending(limit)
+    if not rows:
+        return 0, 0, 0
+    entries = [(row['ID'], dict(row['Payload'], dedup_key=dedup_key(row))) for row in rows]
+    results = {}
+    # a row skipped by the coalesce window would be marked sent without a publish
+    failed, _ = send_notifications(entries, results, coalesce=False)
+    failed = set(failed)
+    stale = 0
+    for row in rows:
+        if row['ID'] in failed:
+            mark_failed(row, results.get(row['ID'], 'Not published'))
+        elif not mark_sent(row):
+            stale += 1
+    if stale:
+        # a newer Version arrived while publishing; it is sent in a later batch
+        metrics.put('OutboxStale', stale)
+    return len(rows), len(rows) - len(failed), len(failed)
+
+
+def drain(remaining_ms=None, batch_size=RELAY_BATCH_SIZE):
+    """Relay batches until the outbox is empty, SNS keeps failing, or time runs out."""
+    totals = {'Fetched': 0, 'Sent': 0, 'Failed': 0, 'Batches': 0}
+    while remaining_ms is None or remaining_ms() > RELAY_RESERVE_MS:
+        fetched, sent, failed = relay_batch(batch_size)
+        totals['Batches'] += 1
+        totals['Fetched'] += fetched
+        totals['Sent'] += sent
+        totals['Failed'] += failed
+        if fetched < batch_size:
+            break
+        if failed and not sent:
+            # back off until the next run instead of hammering a failing topic
+            break
+    metrics.put('OutboxSent', totals['Sent'])
+    metrics.put('OutboxFailed', totals['Failed'])
+    return totals
+
+
+def lambda_handler(event, context):
+    try:
+        return drain(getattr(context, 'get_remaining_time_in_millis', None))
+    finally:
+        metrics.flush()
+
+
+if __name__ == '__main__':
+    while True:
+        totals = drain()
+        print(totals)
+        if totals['Fetched'] < RELAY_BATCH_SIZE:
+            time.sleep(5)
@@ -0,0 +1,52 @@
+import threading
+
+import boto3
+
+# Each Lambda image only contains its own directory, so this module is
+# copied verbatim into catalogs/, notifications/ and sales/.
+
+_lock = threading.RLock()
+_clients = {}
+_resources = {}
+
+
+def client(service_name):
+    """Memoized boto3 client, built on first use."""
+    with _lock:
+        if service_name not in _clients:
+            _clients[service_name] = boto3.client(service_name)
+        return _clients[service_name]
+
+
+def resource(service_name):
+    """Memoized boto3 resource, built on first use."""
+    with _lock:
+        if service_name not in _resources:
+            _resources[service_name] = boto3.resource(service_name)
+        return _resources[service_name]
+
+
+class Lazy:
+    """Module-level stand-in for a client, resource or table.
+
+    The factory runs on first attribute access, so a cold start only pays
+    for the AWS objects the invoked route actually touches.
+    """
+
+    def __init__(self, factory):
+        self._factory = factory
+        self._target = None
+
+    def _resolve(self):
+        if self._target is None:
+            with _lock:
+                if self._target is None:
+                    self._target = self._factory()
+        return self._target
+
+    def __getattr__(self, name):
+        return getattr(self._resolve(), name)
+
+
+def lazy(factory):
+    return Lazy(factory)
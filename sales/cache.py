@@ -0,0 +1,143 @@
+import os
+import threading
+import time
+from collections import OrderedDict
+
+import aws
+import metrics
+
+# Each Lambda image only contains its own directory, so this module is
+# copied verbatim into catalogs/ and sales/.
+
+CACHE_TTL_SECONDS = float(os.getenv('CACHE_TTL_SECONDS', '300'))
+CACHE_MAX_ENTRIES = int(os.getenv('CACHE_MAX_ENTRIES', '2048'))
+# how often a warm container re-reads the version stamps written by catalog updates
+VERSION_CHECK_SECONDS = float(os.getenv('CACHE_VERSION_CHECK_SECONDS', '5'))
+VERSIONS_TABLE = 'CacheVersions'
+
+_MISSING = object()
+_caches = {}
+_versions = {}
+_versions_checked_at = None
+_versions_lock = threading.Lock()
+
+
+class TTLCache:
+    """Thread-safe LRU cache whose entries also expire after a TTL."""
+
+    def __init__(self, name, max_entries=CACHE_MAX_ENTRIES, ttl=CACHE_TTL_SECONDS):
+        self.name = name
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, key, default=None):
+        now = time.monotonic()
+        with self._lock:
+            entry = self._entries.get(key, _MISSING)
+            if entry is not _MISSING and entry[0] > now:
+                self._entries.move_to_end(key)
+                self.hits += 1
+                return entry[1]
+            if entry is not _MISSING:
+                del self._entries[key]
+            self.misses += 1
+            return default
+
+    def put(self, key, value):
+        with self._lock:
+            self._entries[key] = (time.monotonic() + self.ttl, value)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def invalidate(self, key):
+        with self._lock:
+            self._entries.pop(key, None)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+    def get_or_load(self, key, loader):
+        """Return the cached value or loader(key); None results are not cached."""
+        value = self.get(key, _MISSING)
+        if value is _MISSING:
+            value = loader(key)
+            if value is not None:
+                self.put(key, value)
+        self.report()
+        return value
+
+    def get_many(self, keys, loader):
+        """Return {key: value} for keys, loading the misses with one loader(missing) call."""
+        found = {}
+        missing = []
+        for key in dict.fromkeys(keys):
+            value = self.get(key, _MISSING)
+            if value is _MISSING:
+                missing.append(key)
+            else:
+                found[key] = value
+        if missing:
+            loaded = loader(missing)
+            for key, value in loaded.items():
+                self.put(key, value)
+            found.update(loaded)
+        self.report()
+        return found
+
+    def report(self):
+        with self._lock:
+            hits, misses = self.hits, self.misses
+            self.hits = self.misses = 0
+        if hits:
+            metrics.put('CacheHit', hits, Cache=self.name)
+        if misses:
+            metrics.put('CacheMiss', misses, Cache=self.name)
+
+
+def get_cache(name):
+    """Cache for one table's items, registered for version-stamp invalidation."""
+    if name not in _caches:
+        _caches[name] = TTLCache(name)
+    return _caches[name]
+
+
+def bump_version(name):
+    """Record a write to table `name` so other containers drop their copies."""
+    get_cache(name).clear()
+    aws.resource('dynamodb').Table(VERSIONS_TABLE).update_item(
+        Key={'ID': name},
+        UpdateExpression='ADD Version :one',
+        ExpressionAttributeValues={':one': 1}
+    )
+
+
+def sync_versions(force=False):
+    """Clear caches whose table changed since the last check (at most every few seconds)."""
+    global _versions_checked_at
+    if not _caches:
+        return
+    with _versions_lock:
+        now = time.monotonic()
+        if not force and _versions_checked_at is not None and now - _versions_checked_at < VERSION_CHECK_SECONDS:
+            return
+        _versions_checked_at = now
+        try:
+            response = aws.resource('dynamodb').batch_get_item(
+                RequestItems={VERSIONS_TABLE: {'Keys': [{'ID': name} for name in _caches]}}
+            )
+        except Exception as e:
+            # without version stamps, fall back to the TTL alone
+            print(f'Error reading cache versions: {e}')
+            return
+        current = {item['ID']: item.get('Version', 0) for item in response['Responses'].get(VERSIONS_TABLE, [])}
+        for name, cache in _caches.items():
+            version = current.get(name, 0)
+            if _versions.get(name, _MISSING) != version:
+                cache.clear()
+            _versions[name] = version
@@ -0,0 +1,141 @@
+import json
+import os
+import threading
+import time
+
+import aws
+
+# Each Lambda image only contains its own directory, so this module is
+# copied verbatim into catalogs/, notifications/ and sales/.
+
+ENV = os.getenv("ENVIRONMENT", "local")
+NAMESPACE = f"MyApp-{ENV}"
+# emf: CloudWatch Embedded Metric Format log lines, no API calls
+# api: batched put_metric_data calls sent from a background thread
+METRICS_MODE = os.getenv("METRICS_MODE", "emf")
+MAX_DATUMS_PER_CALL = 1000
+MAX_EMF_METRICS = 100
+
+_buffer = []
+_lock = threading.Lock()
+_dimensions = {}
+_sender = None
+
+
+def set_dimensions(**dimensions):
+    """Dimensions attached to every data point until the next call."""
+    global _dimensions
+    _dimensions = {k: str(v) for k, v in dimensions.items() if v}
+
+
+def put(name, value, unit="Count", **dimensions):
+    dims = dict(_dimensions, **{k: str(v) for k, v in dimensions.items()})
+    with _lock:
+        _buffer.append((name, value, unit, dims, time.time()))
+
+
+def flush():
+    with _lock:
+        datums = list(_buffer)
+        _buffer.clear()
+    if not datums:
+        return
+    if METRICS_MODE == "api":
+        _send_async(datums)
+    else:
+        _emit_emf(datums)
+
+
+def _emit_emf(datums):
+    groups = {}
+    for name, value, unit, dims, _ in datums:
+        groups.setdefault(tuple(sorted(dims.items())), []).append((name, value, unit))
+
+    for dims, points in groups.items():
+        values = {}
+        units = {}
+        for name, value, unit in points:
+            values.setdefault(name, []).append(value)
+            units[name] = unit
+        names = list(values)
+        for start in range(0, len(names), MAX_EMF_METRICS):
+            chunk = names[start:start + MAX_EMF_METRICS]
+            record = {
+                "_aws": {
+                    "Timestamp": int(time.time() * 1000),
+                    "CloudWatchMetrics": [{
+                        "Namespace": NAMESPACE,
+                        "Dimensions": [[k for k, _ in dims]],
+                        "Metrics": [{"Name": name, "Unit": units[name]} for name in chunk]
+                    }]
+                }
+            }
+            record.update(dict(dims))
+            for name in chunk:
+                record[name] = values[name] if len(values[name]) > 1 else values[name][0]
+            print(json.dumps(record))
+
+
+def _send_async(datums):
+    global _sender
+    # at most one send in flight; a slow previous batch delays only this flush
+    if _sender is not None:
+        _sender.join()
+    _sender = threading.Thread(target=_send, args=(datums,), daemon=True)
+    _sender.start()
+
+
+def _send(datums):
+    metric_data = [
+        {
+            "MetricName": name,
+            "Value": value,
+            "Unit": unit,
+            "Timestamp": timestamp,
+            "Dimensions": [{"Name": k, "Value": v} for k, v in dims.items()]
+        }
+        for name, value, unit, dims, timestamp in datums
+    ]
+    for start in range(0, len(metric_data), MAX_DATUMS_PER_CALL):
+        try:
+            aws.client("cloudwatch").put_metric_data(Namespace=NAMESPACE, MetricData=metric_data[start:start + MAX_DATUMS_PER_CALL])
+        except Exception as e:
+            # metrics must never fail the request
+            print(f"Error sending metrics: {e}")
+
+
+def instrumented(handler):
+    def wrapper(event, context):
+        start = time.time()
+        # direct invocations may pass a list instead of an event object
+        request = event if isinstance(event, dict) else {}
+        set_dimensions(
+            Route=request.get("routeKey") or request.get("action"),
+            Method=request.get("requestContext", {}).get("http", {}).get("method")
+        )
+
+        try:
+            response = handler(event, context)
+        except Exception:
+            put("HTTP_5XX", 1)
+            flush()
+            raise
+
+        duration = (time.time() - start) * 1000
+
+        status = response.get("statusCode", 200) if isinstance(response, dict) else 200
+        if 200 <= status < 300:
+            put("HTTP_2XX", 1)
+        elif 300 <= status < 400:
+            put("HTTP_3XX", 1)
+        elif 400 <= status < 500:
+            put("HTTP_4XX", 1)
+        else:
+            put("HTTP_5XX", 1)
+
+        put("LatencyMs", duration, unit="Milliseconds")
+        flush()
+
+        return response
+
+    return wrapper
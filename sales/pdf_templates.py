@@ -0,0 +1,140 @@
+from functools import lru_cache
+from xml.sax.saxutils import escape
+
+from reportlab.lib import colors
+from reportlab.lib.pagesizes import letter
+from reportlab.lib.styles import ParagraphStyle, getSampleStyleSheet
+from reportlab.pdfbase.pdfmetrics import stringWidth
+from reportlab.platypus import Paragraph, SimpleDocTemplate, Table, TableStyle
+
+# Rows per items Table flowable. Several small tables lay out in linear
+# time, where one table of thousands of rows is much slower to split.
+ITEM_CHUNK_ROWS = 200
+# SimpleDocTemplate frame width on letter with its default 1 inch margins
+ITEM_COL_WIDTHS = [70, 208, 95, 95]
+# room for text in the Producto column, inside the cells' 6pt side paddings
+PRODUCT_TEXT_WIDTH = ITEM_COL_WIDTHS[1] - 12
+ITEMS_HEADER = ['Cantidad', 'Producto', 'Precio Unitario', 'Importe']
+# how far ahead of the layout engine flowables are generated
+LOOKAHEAD = 3
+
+
+class NoteTemplate:
+    """Styles and table styles shared by every note PDF in the container."""
+
+    def __init__(self):
+        self.styles = getSampleStyleSheet()
+        self.product_style = ParagraphStyle('Producto', parent=self.styles['BodyText'], fontName='Helvetica', fontSize=10, leading=12)
+        self.client_table_style = TableStyle([
+            ('GRID', (0,0), (-1,-1), 1, colors.black),
+            ('FONT', (0,0), (-1,-1), 'Helvetica', 10)
+        ])
+        self.items_body_style = TableStyle([
+            ('GRID', (0,0), (-1,-1), 1, colors.black),
+            ('FONT', (0,0), (-1,-1), 'Helvetica', 10),
+            ('VALIGN', (0,0), (-1,-1), 'TOP')
+        ])
+        self.items_header_style = TableStyle([
+            ('GRID', (0,0), (-1,-1), 1, colors.black),
+            ('FONT', (0,0), (-1,-1), 'Helvetica', 10),
+            ('VALIGN', (0,0), (-1,-1), 'TOP'),
+            ('BACKGROUND', (0,0), (-1,0), colors.grey),
+            ('TEXTCOLOR', (0,0), (-1,0), colors.whitesmoke)
+        ])
+
+    def story(self, client, folio, items, products):
+        """Yield the note's flowables, building item tables one chunk at a time."""
+        yield Paragraph("Client Information", self.styles['Heading1'])
+        client_table = Table([
+            ['Razon Social', client['RazonSocial']],
+            ['Nombre Comercial', client['NombreComercial']],
+            ['RFC', client['RFC']],
+            ['Correo', client['CorreoElectronico']],
+            ['Telefono', client['Telefono']]
+        ])
+        client_table.setStyle(self.client_table_style)
+        yield client_table
+
+        yield Paragraph(f"Note Folio: {folio}", self.styles['Heading2'])
+
+        rows = [ITEMS_HEADER]
+        style = self.items_header_style
+        for item in items:
+            rows.append([
+                str(item['Cantidad']),
+                self.product_cell(products[item['ProductoID']]['Nombre']),
+                f"${item['PrecioUnitario']:.2f}",
+                f"${item['Importe']:.2f}"
+            ])
+            if len(rows) >= ITEM_CHUNK_ROWS:
+                yield Table(rows, colWidths=ITEM_COL_WIDTHS, style=style)
+                rows = []
+                style = self.items_body_style
+        if rows:
+            yield Table(rows, colWidths=ITEM_COL_WIDTHS, style=style)
+
+
+    def product_cell(self, name):
+        """The name as is, or wrapped in a Paragraph when it is wider than its column.
+
+        Plain strings do not wrap and would run into the next column; short
+        names skip the Paragraph, which costs far more to lay out.
+        """
+        name = str(name)
+        if stringWidth(name, 'Helvetica', 10) <= PRODUCT_TEXT_WIDTH:
+            return name
+        return Paragraph(escape(name), self.product_style)
+
+
+class FlowableStream(list):
+    """List facade over a flowable generator for SimpleDocTemplate.build.
+
+    The layout engine only looks at the front of its story, so flowables
+    are pulled from the generator as it consumes them instead of building
+    the whole story up front.
+    """
+
+    def __init__(self, source):
+        super().__init__()
+        self._source = iter(source)
+
+    def _fill(self, count=None):
+        while self._source is not None and (count is None or list.__len__(self) < count):
+            try:
+                list.append(self, next(self._source))
+            except StopIteration:
+                self._source = None
+
+    def _fill_for(self, key):
+        if isinstance(key, slice):
+            self._fill(None if key.stop is None or key.stop < 0 else key.stop)
+        else:
+            self._fill(None if key < 0 else key + 1)
+
+    def __len__(self):
+        self._fill(LOOKAHEAD)
+        return list.__len__(self)
+
+    def __getitem__(self, key):
+        self._fill_for(key)
+        return list.__getitem__(self, key)
+
+    def __delitem__(self, key):
+        self._fill_for(key)
+        list.__delitem__(self, key)
+
+    def __setitem__(self, key, value):
+        self._fill_for(key)
+        list.__setitem__(self, key, value)
+
+
+@lru_cache(maxsize=1)
+def get_template():
+    return NoteTemplate()
+
+
+def render_note(sink, client, folio, items, products):
+    """Render a note PDF into any writable file-like object."""
+    doc = SimpleDocTemplate(sink, pagesize=letter)
+    doc.build(FlowableStream(get_template().story(client, folio, items, products)))
+    return sink
@@ -0,0 +1,248 @@
+"""Rebuild the stored PDFs of every note of a client or a date range.
+
+Run it from the sales image or a checkout of this directory, e.g. after a
+client's RFC or RazonSocial changed:
+
+    python regenerate_pdfs.py --cliente-id <ID>
+    python regenerate_pdfs.py --desde 2026-01-01 --hasta 2026-01-31 --checkpoint jan.done
+
+It renders in a process pool, so run it on a machine with several cores,
+not inside a Lambda invocation.
+"""
+import argparse
+import json
+import os
+import sys
+import time
+from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor, ThreadPoolExecutor, wait
+from datetime import datetime
+from io import BytesIO
+
+from boto3.dynamodb.conditions import Attr, Key
+
+from sales_lambda import (
+    BATCH_GET_LIMIT, compute_render_hash, dynamodb, pdf_downloads_table,
+    put_pdf_if_newer, record_render_hash, resolve_products, sales_notes_table
+)
+from schema import SALES_NOTE_ITEMS_INDEX, SALES_NOTES_CLIENT_INDEX
+
+RENDER_PROCESSES = os.cpu_count() or 1
+UPLOAD_WORKERS = 16
+PROGRESS_EVERY = 25
+# notes whose items are fetched together, ahead of rendering
+PREFETCH_NOTES = 100
+
+
+def find_notes(cliente_id=None, desde=None, hasta=None):
+    conditions = []
+    if desde:
+        conditions.append(Attr('Fecha').gte(desde))
+    if hasta:
+        # dates are ISO timestamps, so a bare end date must include that whole day
+        conditions.append(Attr('Fecha').lte(hasta + '~'))
+    if cliente_id:
+        # one client's notes come from its index, including those without Fecha
+        read = sales_notes_table.query
+        read_kwargs = {'IndexName': SALES_NOTES_CLIENT_INDEX, 'KeyConditionExpression': Key('ClienteID').eq(cliente_id)}
+    else:
+        read = sales_notes_table.scan
+        read_kwargs = {}
+    if conditions:
+        filter_expression = conditions[0]
+        for condition in conditions[1:]:
+            filter_expression = filter_expression & condition
+        read_kwargs['FilterExpression'] = filter_expression
+
+    notes = []
+    while True:
+        response = read(**read_kwargs)
+        notes.extend(response['Items'])
+        if 'LastEvaluatedKey' not in response:
+            return notes
+        read_kwargs['ExclusiveStartKey'] = response['LastEvaluatedKey']
+
+
+def fetch_clients(client_ids):
+    clients = {}
+    keys = [{'ID': client_id} for client_id in dict.fromkeys(client_ids)]
+    for start in range(0, len(keys), BATCH_GET_LIMIT):
+        request_items = {'Clients': {'Keys': keys[start:start + BATCH_GET_LIMIT]}}
+        while request_items:
+            response = dynamodb.batch_get_item(RequestItems=request_items)
+            for client in response['Responses'].get('Clients', []):
+                clients[client['ID']] = client
+            request_items = response.get('UnprocessedKeys')
+            if request_items:
+                time.sleep(0.1)
+    return clients
+
+
+def fetch_note_items(note_id):
+    # same as sales_lambda.query_note_items, but through the thread-safe client
+    items = []
+    query_kwargs = {
+        'TableName': 'SalesNoteItems',
+        'IndexName': SALES_NOTE_ITEMS_INDEX,
+        'KeyConditionExpression': Key('SalesNoteID').eq(note_id)
+    }
+    while True:
+        response = dynamodb.meta.client.query(**query_kwargs)
+        items.extend(response['Items'])
+        if 'LastEvaluatedKey' not in response:
+            return items
+        query_kwargs['ExclusiveStartKey'] = response['LastEvaluatedKey']
+
+
+def render(client, folio, items, products):
+    # runs in a worker process
+    import pdf_templates
+    return pdf_templates.render_note(BytesIO(), client, folio, items, products).getvalue()
+
+
+def upload(job, pdf_data):
+    note = job['note']
+    # regenerating is not a send, so the counter on the note row is kept as is
+    metadata = {
+        'hora-regeneracion': datetime.utcnow().isoformat(),
+        'veces-enviado': str(note.get('VecesEnviado', 0)),
+        'render-hash': job['render_hash']
+    }
+    if note.get('HoraEnvio'):
+        metadata['hora-envio'] = note['HoraEnvio']
+    veces_enviado = int(note.get('VecesEnviado', 0))
+    if not put_pdf_if_newer(job['s3_key'], BytesIO(pdf_data), metadata, veces_enviado):
+        # the note was sent again meanwhile, with a freshly rendered PDF
+        return
+    record_render_hash(note['ID'], job['render_hash'], veces_enviado)
+    pdf_downloads_table.put_item(Item={
+        'ID': job['s3_key'],
+        'SalesNoteID': job['note']['ID'],
+        'Descargada': False,
+        'Descargas': 0,
+        'Tamano': len(pdf_data),
+        'SubidoEn': metadata['hora-regeneracion']
+    })
+
+
+def load_checkpoint(path):
+    if not path or not os.path.exists(path):
+        return set()
+    with open(path) as f:
+        return {line.strip() for line in f if line.strip()}
+
+
+def regenerate(notes, processes=RENDER_PROCESSES, upload_workers=UPLOAD_WORKERS, checkpoint=None, force=False,
+               max_in_flight=None):
+    done = load_checkpoint(checkpoint)
+    pending = [note for note in notes if note['ID'] not in done]
+    stats = {'total': len(notes), 'skipped_checkpoint': len(notes) - len(pending), 'unchanged': 0, 'rendered': 0, 'failed': 0}
+    start = time.time()
+    checkpoint_file = open(checkpoint, 'a') if checkpoint else None
+
+    def mark_done(note_id):
+        if checkpoint_file:
+            checkpoint_file.write(note_id + '\n')
+            checkpoint_file.flush()
+
+    def report(final=False):
+        finished = stats['unchanged'] + stats['rendered'] + stats['failed']
+        if final or finished % PROGRESS_EVERY == 0:
+            rate = finished / max(time.time() - start, 1e-6)
+            print(f"[{finished}/{len(pending)}] rendered={stats['rendered']} unchanged={stats['unchanged']} "
+                  f"failed={stats['failed']} ({rate:.1f} notes/s)", file=sys.stderr)
+
+    def jobs():
+        """Render jobs of the pending notes, prefetching items one window of notes at a time."""
+        for window_start in range(0, len(pending), PREFETCH_NOTES):
+            window = pending[window_start:window_start + PREFETCH_NOTES]
+            clients = fetch_clients(note['ClienteID'] for note in window)
+            items_by_note = dict(zip(
+                (note['ID'] for note in window),
+                io_pool.map(lambda note: fetch_note_items(note['ID']), window)
+            ))
+            products = resolve_products(i['ProductoID'] for items in items_by_note.values() for i in items)
+            for note in window:
+                client = clients.get(note['ClienteID'])
+                if not client:
+                    print(f"Skipping note {note['ID']}: client {note['ClienteID']} not found", file=sys.stderr)
+                    stats['failed'] += 1
+                    report()
+                    continue
+                items = sorted(items_by_note[note['ID']], key=lambda i: (i['ProductoID'], i['ID']))
+                missing = sorted({i['ProductoID'] for i in items} - products.keys())
+                if missing:
+                    print(f"Skipping note {note['ID']}: products {', '.join(missing)} not found", file=sys.stderr)
+                    stats['failed'] += 1
+                    report()
+                    continue
+                note_products = {i['ProductoID']: products[i['ProductoID']] for i in items}
+                render_hash = compute_render_hash(client, note['Folio'], items, note_products)
+                if not force and note.get('RenderHash') == render_hash:
+                    stats['unchanged'] += 1
+                    mark_done(note['ID'])
+                    report()
+                    continue
+                yield {
+                    'note': note,
+                    'client': client,
+                    'items': items,
+                    'products': note_products,
+                    's3_key': f"{client['RFC']}/{note['Folio']}.pdf",
+                    'render_hash': render_hash
+                }
+
+    # a note holds its items, then its PDF bytes, from submission until uploaded,
+    # so capping the notes in flight caps memory whatever the size of the run
+    max_in_flight = max_in_flight or 2 * (processes + upload_workers)
+    with ThreadPoolExecutor(max_workers=upload_workers) as io_pool, ProcessPoolExecutor(max_workers=processes) as render_pool:
+        pending_jobs = jobs()
+        in_flight = {}
+
+        def fill():
+            for job in pending_jobs:
+                future = render_pool.submit(render, job['client'], job['note']['Folio'], job['items'], job['products'])
+                in_flight[future] = ('render', job)
+                if len(in_flight) >= max_in_flight:
+                    return
+
+        fill()
+        while in_flight:
+            finished, _ = wait(in_flight, return_when=FIRST_COMPLETED)
+            for future in finished:
+                stage, job = in_flight.pop(future)
+                try:
+                    result = future.result()
+                except Exception as e:
+                    print(f"Note {job['note']['ID']} failed during {stage}: {e}", file=sys.stderr)
+                    stats['failed'] += 1
+                    report()
+                    continue
+                if stage == 'render':
+                    in_flight[io_pool.submit(upload, job, result)] = ('upload', job)
+                else:
+                    stats['rendered'] += 1
+                    mark_done(job['note']['ID'])
+                    report()
+            fill()
+
+    if checkpoint_file:
+        checkpoint_file.close()
+    report(final=True)
+    return stats
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Regenerate sales note PDFs in bulk')
+    parser.add_argument('--cliente-id')
+    parser.add_argument('--desde', help='first creation date, YYYY-MM-DD')
+    parser.add_argument('--hasta', help='last creation date, YYYY-MM-DD')
+    parser.add_argument('--processes', type=int, default=RENDER_PROCESSES)
+    parser.add_argument('--upload-workers', type=int, default=UPLOAD_WORKERS)
+    parser.add_argument('--checkpoint', help='file of finished note IDs; rerun with it to resume')
+    parser.add_argument('--force', action='store_true', help='re-render even when the stored PDF is current')
+    args = parser.parse_args()
+    if not (args.cliente_id or args.desde or args.hasta):
+        parser.error('give --cliente-id and/or a --desde/--hasta range')
+
+    notes = find_notes(args.cliente_id, args.desde, args.hasta)
+    print(json.dumps(regenerate(notes, args.processes, args.upload_workers, args.checkpoint, args.force)))
@@ -0,0 +1,98 @@
+import json
+import os
+import time
+import uuid
+from collections import deque
+
+import aws
+
+# RENDER_QUEUE_URL selects the backend:
+#   https://sqs...        an SQS queue consumed by render_worker.lambda_handler
+#   file:///some/dir      a directory queue, one JSON file per message
+#   memory                an in-process deque, for local runs of a single process
+# Unset, async rendering is not available: nothing would ever run the jobs.
+RENDER_QUEUE_URL = os.getenv('RENDER_QUEUE_URL', '')
+
+_memory_queue = deque()
+
+
+def configured():
+    return RENDER_QUEUE_URL.startswith(('https://', 'file://')) or RENDER_QUEUE_URL == 'memory'
+
+
+def _backend():
+    if RENDER_QUEUE_URL.startswith('https://'):
+        return 'sqs'
+    if RENDER_QUEUE_URL.startswith('file://'):
+        return 'file'
+    if RENDER_QUEUE_URL == 'memory':
+        return 'memory'
+    raise ValueError(f'RENDER_QUEUE_URL must be an SQS queue URL, a file:// directory or "memory", not {RENDER_QUEUE_URL!r}')
+
+
+def _queue_dir():
+    path = RENDER_QUEUE_URL[len('file://'):]
+    os.makedirs(path, exist_ok=True)
+    return path
+
+
+def enqueue(message):
+    backend = _backend()
+    if backend == 'sqs':
+        aws.client('sqs').send_message(QueueUrl=RENDER_QUEUE_URL, MessageBody=json.dumps(message))
+    elif backend == 'file':
+        name = f'{time.time_ns()}-{uuid.uuid4()}.json'
+        tmp_path = os.path.join(_queue_dir(), name + '.tmp')
+        with open(tmp_path, 'w') as f:
+            json.dump(message, f)
+        os.rename(tmp_path, os.path.join(_queue_dir(), name))
+    else:
+        _memory_queue.append(message)
+
+
+def receive(max_messages=10):
+    """Claim up to max_messages from a local backend as (receipt, message) pairs.
+
+    SQS messages are delivered to the worker by the Lambda event source
+    mapping instead, so this only serves the file and memory backends.
+    """
+    backend = _backend()
+    if backend == 'sqs':
+        raise ValueError('SQS messages are delivered through the Lambda event source mapping')
+
+    claimed = []
+    if backend == 'memory':
+        while _memory_queue and len(claimed) < max_messages:
+            message = _memory_queue.popleft()
+            claimed.append((message, message))
+        return claimed
+
+    queue_dir = _queue_dir()
+    for name in sorted(os.listdir(queue_dir)):
+        if len(claimed) >= max_messages:
+            break
+        if not name.endswith('.json'):
+            continue
+        path = os.path.join(queue_dir, name)
+        receipt = path + '.processing'
+        try:
+            # rename is atomic, so concurrent local workers never claim the same file
+            os.rename(path, receipt)
+        except FileNotFoundError:
+            continue
+        with open(receipt) as f:
+            claimed.append((receipt, json.load(f)))
+    return claimed
+
+
+def delete(receipt):
+    if _backend() == 'file':
+        os.remove(receipt)
+
+
+def release(receipt):
+    """Put a claimed message back on a local queue so it is retried."""
+    if _backend() == 'file':
+        os.rename(receipt, receipt[:-len('.processing')])
+    elif _backend() == 'memory':
+        _memory_queue.append(receipt)
@@ -0,0 +1,120 @@
+import json
+import os
+import time
+from datetime import datetime, timedelta
+
+from botocore.exceptions import ClientError
+
+import metrics
+import render_queue
+from cache import sync_versions
+from sales_lambda import publish_note_pdf, render_jobs_table, sales_notes_table
+from tracing import trace_request
+
+LEASE_SECONDS = int(os.getenv('RENDER_LEASE_SECONDS', '300'))
+
+
+def claim_job(job_id):
+    """Mark a job as rendering, or return None if it is finished or leased.
+
+    Redelivered or duplicated messages for a job that is already done (or
+    being rendered by another worker) are skipped, which keeps retries
+    idempotent.
+    """
+    now = datetime.utcnow()
+    try:
+        return render_jobs_table.update_item(
+            Key={'ID': job_id},
+            UpdateExpression='SET Estado = :rendering, LeaseHasta = :lease, ActualizadoEn = :now ADD Intentos :one',
+            ConditionExpression='Estado IN (:queued, :failed) OR (Estado = :rendering AND LeaseHasta < :now)',
+            ExpressionAttributeValues={
+                ':rendering': 'rendering',
+                ':queued': 'queued',
+                ':failed': 'failed',
+                ':lease': (now + timedelta(seconds=LEASE_SECONDS)).isoformat(),
+                ':now': now.isoformat(),
+                ':one': 1
+            },
+            ReturnValues='ALL_NEW'
+        )['Attributes']
+    except ClientError as e:
+        if e.response['Error']['Code'] == 'ConditionalCheckFailedException':
+            return None
+        raise
+
+
+def finish_job(job_id, estado, **fields):
+    fields.update({'Estado': estado, 'ActualizadoEn': datetime.utcnow().isoformat()})
+    names = {f'#{k}': k for k in fields}
+    render_jobs_table.update_item(
+        Key={'ID': job_id},
+        UpdateExpression='SET ' + ', '.join(f'#{k} = :{k}' for k in fields) + ' REMOVE LeaseHasta',
+        ExpressionAttributeNames=names,
+        ExpressionAttributeValues={f':{k}': v for k, v in fields.items()}
+    )
+
+
+def process_job(message):
+    job = claim_job(message['JobID'])
+    if job is None:
+        return
+
+    note = sales_notes_table.get_item(Key={'ID': message['SalesNoteID']}).get('Item')
+    if not note:
+        # nothing to retry: the note is gone
+        finish_job(job['ID'], 'failed', Error=f"Sales note {message['SalesNoteID']} not found")
+        return
+
+    try:
+        veces_enviado = publish_note_pdf(note)
+    except Exception as e:
+        finish_job(job['ID'], 'failed', Error=str(e))
+        raise
+    finish_job(job['ID'], 'done', VecesEnviado=veces_enviado)
+
+
+@trace_request
+def process_records(event, context):
+    sync_versions()
+    failures = []
+    for record in event.get('Records', []):
+        try:
+            process_job(json.loads(record['body']))
+        except Exception as e:
+            print(f"Render job failed for message {record['messageId']}: {e}")
+            failures.append({'itemIdentifier': record['messageId']})
+    return {'batchItemFailures': failures}
+
+
+def lambda_handler(event, context):
+    """SQS entry point. Failed messages are reported back for redelivery."""
+    try:
+        return process_records(event, context)
+    finally:
+        metrics.flush()
+
+
+def drain_local(max_messages=10, max_attempts=3):
+    """Process the file or memory queue until it is empty."""
+    attempts = {}
+    while True:
+        messages = render_queue.receive(max_messages)
+        if not messages:
+            metrics.flush()
+            return
+        for receipt, message in messages:
+            try:
+                process_job(message)
+                render_queue.delete(receipt)
+            except Exception as e:
+                attempts[message['JobID']] = attempts.get(message['JobID'], 0) + 1
+                print(f"Render job {message['JobID']} failed: {e}")
+                if attempts[message['JobID']] < max_attempts:
+                    time.sleep(0.5 * attempts[message['JobID']])
+                    render_queue.release(receipt)
+                else:
+                    render_queue.delete(receipt)
+
+
+if __name__ == '__main__':
+    drain_local()
@@ -0,0 +1,191 @@
+"""Rebuild the SalesRollups table from a full export of the sales tables.
+
+Reads SalesNotes and SalesNoteItems exports, either NDJSON of plain items or
+the DynamoDB JSON written by ExportTableToPointInTime (gzipped or not), from
+local paths or s3://bucket/prefix URIs:
+
+    python rollup_backfill.py --notes s3://exports/SalesNotes/ --items s3://exports/SalesNoteItems/
+    python rollup_backfill.py --notes notes.ndjson --items items.ndjson --dry-run
+
+Items are loaded into NumPy columns and summed per group with one sort and
+reduceat per dimension. Amounts are summed as scaled int64, so the totals are
+exact. It needs numpy, which the Lambda images do not include.
+
+Run it while no items are being written (and the stream consumer has
+caught up), or the rows rollup_stream.py ADDs during the rebuild can be
+overwritten. Use --truncate to drop rollup rows of groups that no longer
+have items.
+"""
+import argparse
+import gzip
+import io
+import json
+import time
+from decimal import Decimal
+
+import numpy as np
+from boto3.dynamodb.types import TypeDeserializer
+
+import aws
+import rollups
+
+# decimal places amounts may have; more would overflow int64 on large tables
+MAX_SCALE = 6
+
+_deserializer = TypeDeserializer()
+
+
+def list_sources(source):
+    if not source.startswith('s3://'):
+        return [source]
+    bucket, _, prefix = source[len('s3://'):].partition('/')
+    paginator = aws.client('s3').get_paginator('list_objects_v2')
+    return [
+        f"s3://{bucket}/{obj['Key']}"
+        for page in paginator.paginate(Bucket=bucket, Prefix=prefix)
+        for obj in page.get('Contents', [])
+        if obj['Key'].endswith(('.json', '.json.gz', '.ndjson', '.ndjson.gz'))
+    ]
+
+
+def open_source(path):
+    if path.startswith('s3://'):
+        bucket, _, key = path[len('s3://'):].partition('/')
+        raw = aws.client('s3').get_object(Bucket=bucket, Key=key)['Body']
+    else:
+        raw = open(path, 'rb')
+    if path.endswith('.gz'):
+        raw = gzip.GzipFile(fileobj=raw, mode='rb')
+    return io.TextIOWrapper(raw, encoding='utf-8')
+
+
+def read_items(source):
+    """Yield plain items from every export file under source."""
+    for path in list_sources(source):
+        with open_source(path) as stream:
+            for line in stream:
+                if not line.strip():
+                    continue
+                record = json.loads(line, parse_float=Decimal, parse_int=Decimal)
+                if 'Item' in record and isinstance(record['Item'], dict):
+                    # DynamoDB JSON: {"Item": {"ID": {"S": "..."}, ...}}
+                    yield {k: _deserializer.deserialize(v) for k, v in record['Item'].items()}
+                else:
+                    yield record
+
+
+def scaled(values):
+    """int64 array of Decimal values times 10**scale, and the scale used."""
+    decimals = [Decimal(v) for v in values]
+    scale = max([0] + [-d.as_tuple().exponent for d in decimals])
+    if scale > MAX_SCALE:
+        raise ValueError(f'Amounts with more than {MAX_SCALE} decimal places are not supported')
+    return np.array([int(d.scaleb(scale)) for d in decimals], dtype=np.int64), scale
+
+
+def group_sums(keys, *columns):
+    """Unique keys and, per column, the int64 sum of its values for each key."""
+    order = np.argsort(keys, kind='stable')
+    sorted_keys = keys[order]
+    starts = np.flatnonzero(np.r_[True, sorted_keys[1:] != sorted_keys[:-1]])
+    sums = [np.add.reduceat(column[order], starts) for column in columns]
+    counts = np.diff(np.r_[starts, len(keys)])
+    return sorted_keys[starts], sums, counts
+
+
+def build_rollups(notes_source, items_source):
+    """Return (rollup rows, stats) for the exported notes and items."""
+    start = time.time()
+    notes = {note['ID']: (note.get('ClienteID', ''), (note.get('Fecha') or '')[:10]) for note in read_items(notes_source)}
+    item_notes, product_ids, importes, cantidades = [], [], [], []
+    orphans = undated = 0
+    for item in read_items(items_source):
+        if item.get('SalesNoteID') not in notes:
+            orphans += 1
+            continue
+        if not notes[item['SalesNoteID']][1]:
+            undated += 1
+            continue
+        item_notes.append(item['SalesNoteID'])
+        product_ids.append(item['ProductoID'])
+        importes.append(item['Importe'])
+        cantidades.append(item['Cantidad'])
+    loaded = time.time()
+
+    if not item_notes:
+        return [], {'Notes': len(notes), 'Items': 0, 'Orphans': orphans, 'Undated': undated, 'Rows': 0}
+
+    note_codes, item_note_codes = np.unique(np.array(item_notes), return_inverse=True)
+    note_clients = np.array([notes[n][0] for n in note_codes])
+    note_days = np.array([notes[n][1] for n in note_codes])
+    client_names, client_codes = np.unique(note_clients[item_note_codes], return_inverse=True)
+    day_names, day_codes = np.unique(note_days[item_note_codes], return_inverse=True)
+    product_names, product_codes = np.unique(np.array(product_ids), return_inverse=True)
+    importe, importe_scale = scaled(importes)
+    cantidad, cantidad_scale = scaled(cantidades)
+
+    dimensions = {
+        'cliente': (client_codes, client_names),
+        'producto': (product_codes, product_names),
+        'dia': (day_codes, day_names),
+    }
+    rows = []
+    for group_by, (group_codes, group_names) in dimensions.items():
+        keys = day_codes.astype(np.int64) * len(group_names) + group_codes
+        unique_keys, (importe_sums, cantidad_sums), counts = group_sums(keys, importe, cantidad)
+        for key, importe_sum, cantidad_sum, count in zip(unique_keys, importe_sums, cantidad_sums, counts):
+            day = str(day_names[key // len(group_names)])
+            rows.append({
+                'ID': rollups.partition(group_by, day),
+                'Clave': str(group_names[key % len(group_names)]),
+                'Importe': Decimal(int(importe_sum)).scaleb(-importe_scale),
+                'Cantidad': Decimal(int(cantidad_sum)).scaleb(-cantidad_scale),
+                'Partidas': int(count)
+            })
+    stats = {
+        'Notes': len(notes),
+        'Items': len(item_notes),
+        'Orphans': orphans,
+        'Undated': undated,
+        'Rows': len(rows),
+        'LoadSeconds': round(loaded - start, 3),
+        'AggregateSeconds': round(time.time() - loaded, 3)
+    }
+    return rows, stats
+
+
+def truncate(table):
+    scan_kwargs = {'ProjectionExpression': 'ID, Clave'}
+    with table.batch_writer() as batch:
+        while True:
+            response = table.scan(**scan_kwargs)
+            for key in response['Items']:
+                batch.delete_item(Key=key)
+            if 'LastEvaluatedKey' not in response:
+                return
+            scan_kwargs['ExclusiveStartKey'] = response['LastEvaluatedKey']
+
+
+def write_rollups(rows, clear=False):
+    table = aws.resource('dynamodb').Table(rollups.ROLLUPS_TABLE)
+    if clear:
+        truncate(table)
+    with table.batch_writer() as batch:
+        for row in rows:
+            batch.put_item(Item=row)
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Rebuild the sales rollups from a full export')
+    parser.add_argument('--notes', required=True, help='SalesNotes export: file or s3://bucket/prefix')
+    parser.add_argument('--items', required=True, help='SalesNoteItems export: file or s3://bucket/prefix')
+    parser.add_argument('--truncate', action='store_true', help='delete every rollup row before writing')
+    parser.add_argument('--dry-run', action='store_true', help='aggregate and report without writing')
+    args = parser.parse_args()
+
+    rows, stats = build_rollups(args.notes, args.items)
+    if not args.dry_run:
+        write_start = time.time()
+        write_rollups(rows, args.truncate)
+        stats['WriteSeconds'] = round(time.time() - write_start, 3)
+    print(json.dumps(stats))
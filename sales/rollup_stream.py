@@ -0,0 +1,99 @@
+"""Keep SalesRollups up to date from the SalesNoteItems stream.
+
+Items used to ADD to their rollups inside the request's item transaction,
+so every append wrote today's dia# row and its client and product rows,
+and busy days conflicted on them. Instead the table's stream feeds this
+Lambda, which sums a whole batch of new items per rollup row and ADDs
+each total once.
+
+Setup: enable the stream (python schema.py does it, with NEW_IMAGE) and map
+it to a function of the sales image with rollup_stream.lambda_handler as
+the command, starting position TRIM_HORIZON. Leave bisect-on-error off: a
+failed batch is retried whole, and its transactions reuse the same
+ClientRequestToken, so DynamoDB applies the ones that had already
+succeeded only once (within its 10 minute token window).
+"""
+import random
+import time
+import uuid
+
+from boto3.dynamodb.types import TypeDeserializer
+from botocore.exceptions import ClientError
+
+import metrics
+import rollups
+from sales_lambda import TRANSACTION_LIMIT, batch_get, dynamodb, retryable_transaction_error
+
+_deserializer = TypeDeserializer()
+
+
+def new_items(records):
+    """Plain items of the INSERT records; items are never modified in place."""
+    items = []
+    for record in records:
+        if record.get('eventName') != 'INSERT':
+            continue
+        image = record['dynamodb']['NewImage']
+        items.append({k: _deserializer.deserialize(v) for k, v in image.items()})
+    return items
+
+
+def batch_totals(items):
+    """aggregate() totals of items from any number of notes."""
+    rows_by_note = {}
+    for item in items:
+        rows_by_note.setdefault(item['SalesNoteID'], []).append(item)
+    notes = batch_get('SalesNotes', rows_by_note)
+    totals = {}
+    for note_id, rows in rows_by_note.items():
+        note = notes.get(note_id)
+        if not note:
+            # without the note there is no client or day to count the items under
+            print(f'Skipping {len(rows)} items of note {note_id}: note not found')
+            metrics.put('RollupItemsSkipped', len(rows))
+            continue
+        if not note.get('Fecha'):
+            # same as rollup_backfill: no day to count them under, and a
+            # retried batch must produce the same updates for its tokens
+            print(f'Skipping {len(rows)} items of note {note_id}: note has no Fecha')
+            metrics.put('RollupItemsSkipped', len(rows))
+            continue
+        rollups.aggregate(note, rows, totals)
+    return totals
+
+
+def write_updates(updates, token, max_retries=10):
+    attempt = 0
+    while True:
+        try:
+            dynamodb.meta.client.transact_write_items(TransactItems=updates, ClientRequestToken=token)
+            return
+        except ClientError as e:
+            # other shards ADD to the same rows, so conflicts are expected
+            if not retryable_transaction_error(e) or attempt >= max_retries:
+                raise
+            time.sleep(random.uniform(0, 0.05 * (2 ** attempt)))
+            attempt += 1
+
+
+def process_records(records):
+    items = new_items(records)
+    if not items:
+        return 0
+    updates = rollups.rollup_updates(batch_totals(items))
+    # the same records always produce the same chunks and tokens
+    batch_id = ','.join(record['dynamodb']['SequenceNumber'] for record in records)
+    for start in range(0, len(updates), TRANSACTION_LIMIT):
+        token = str(uuid.uuid5(uuid.NAMESPACE_URL, f'{batch_id}#{start}'))
+        write_updates(updates[start:start + TRANSACTION_LIMIT], token)
+    metrics.put('RollupItems', len(items))
+    metrics.put('RollupUpdates', len(updates))
+    return len(items)
+
+
+def lambda_handler(event, context):
+    """DynamoDB Streams entry point. An exception retries the whole batch."""
+    try:
+        return {'Items': process_records(event.get('Records', []))}
+    finally:
+        metrics.flush()
@@ -0,0 +1,101 @@
+"""Precomputed sales totals per client, per product and per day.
+
+Rows of the SalesRollups table (key ID + Clave) hold the ADDed Importe,
+Cantidad and Partidas (item count) of one group in one period:
+
+    ID                     Clave          group
+    cliente#2026-10-17     <ClienteID>    a client's sales on that day
+    producto#2026-10-17    <ProductoID>   a product's sales on that day
+    dia#2026-10            2026-10-17     all sales on that day
+
+so a report reads one partition per day (per month for group_by=dia) and
+only the groups that sold in it, never the notes or their items. Sales are
+dated by the note's Fecha, which is what rollup_backfill.py uses as well;
+notes without one (created before Fecha existed) are left out of both.
+
+rollup_stream.py ADDs new items from the SalesNoteItems stream, so the
+busy rows (today's dia# partition, a popular product) are written once per
+stream batch instead of inside every request's item transaction.
+"""
+from datetime import timedelta
+from decimal import Decimal
+
+from boto3.dynamodb.conditions import Key
+
+ROLLUPS_TABLE = 'SalesRollups'
+GROUP_BYS = ('cliente', 'producto', 'dia')
+MAX_REPORT_DAYS = 366
+
+
+def partition(group_by, day):
+    """Partition key of a group_by for an ISO day (YYYY-MM-DD)."""
+    return f'dia#{day[:7]}' if group_by == 'dia' else f'{group_by}#{day}'
+
+
+def group_key(group_by, cliente_id, producto_id, day):
+    return {'cliente': cliente_id, 'producto': producto_id, 'dia': day}[group_by]
+
+
+def aggregate(note, rows, totals=None):
+    """{(ID, Clave): [Importe, Cantidad, Partidas]} for items added to a note.
+
+    Pass totals to add the rows of several notes into one dict. The note
+    must have a Fecha; callers skip the ones that do not.
+    """
+    day = note['Fecha'][:10]
+    totals = {} if totals is None else totals
+    for row in rows:
+        for group_by in GROUP_BYS:
+            key = (partition(group_by, day), group_key(group_by, note['ClienteID'], row['ProductoID'], day))
+            total = totals.setdefault(key, [Decimal(0), 0, 0])
+            total[0] += row['Importe']
+            total[1] += row['Cantidad']
+            total[2] += 1
+    return totals
+
+
+def rollup_updates(totals):
+    """TransactWriteItems Updates that ADD aggregate() totals to their rollups."""
+    return [
+        {'Update': {
+            'TableName': ROLLUPS_TABLE,
+            'Key': {'ID': partition_key, 'Clave': clave},
+            'UpdateExpression': 'ADD Importe :importe, Cantidad :cantidad, Partidas :partidas',
+            'ExpressionAttributeValues': {':importe': importe, ':cantidad': cantidad, ':partidas': partidas}
+        }}
+        for (partition_key, clave), (importe, cantidad, partidas) in totals.items()
+    ]
+
+
+def report_partitions(group_by, desde, hasta):
+    """(partition key, first Clave, last Clave) queries covering desde..hasta (dates)."""
+    days = [desde + timedelta(days=n) for n in range((hasta - desde).days + 1)]
+    if group_by != 'dia':
+        return [(partition(group_by, day.isoformat()), None, None) for day in days]
+    months = dict.fromkeys(partition('dia', day.isoformat()) for day in days)
+    return [(month, desde.isoformat(), hasta.isoformat()) for month in months]
+
+
+def query_partition(client, partition_key, first=None, last=None):
+    condition = Key('ID').eq(partition_key)
+    if first:
+        condition = condition & Key('Clave').between(first, last)
+    query_kwargs = {'TableName': ROLLUPS_TABLE, 'KeyConditionExpression': condition}
+    rows = []
+    while True:
+        response = client.query(**query_kwargs)
+        rows.extend(response['Items'])
+        if 'LastEvaluatedKey' not in response:
+            return rows
+        query_kwargs['ExclusiveStartKey'] = response['LastEvaluatedKey']
+
+
+def merge(rows):
+    """Sum rollup rows of several periods into one total per group."""
+    groups = {}
+    for row in rows:
+        total = groups.setdefault(row['Clave'], {'Clave': row['Clave'], 'Importe': Decimal(0), 'Cantidad': Decimal(0), 'Partidas': Decimal(0)})
+        total['Importe'] += row.get('Importe', 0)
+        total['Cantidad'] += row.get('Cantidad', 0)
+        total['Partidas'] += row.get('Partidas', 0)
+    return sorted(groups.values(), key=lambda g: g['Importe'], reverse=True)
@@ -1,316 +1,857 @@
 import json
-import boto3
+import aws
+import metrics
+from metrics import instrumented
 import uuid
 import base64
+import hashlib
 import time
 import os
-from datetime import datetime
+import random
+import tempfile
+from concurrent.futures import ThreadPoolExecutor
+from datetime import date, datetime, timedelta
 from decimal import Decimal
-from reportlab.lib import colors
-from reportlab.lib.pagesizes import letter
-from reportlab.platypus import SimpleDocTemplate, Table, TableStyle, Paragraph
-from reportlab.lib.styles import getSampleStyleSheet
+from boto3.dynamodb.conditions import Key
+from boto3.dynamodb.types import DYNAMODB_CONTEXT
 from botocore.exceptions import ClientError
 from io import BytesIO
-
-dynamodb = boto3.resource('dynamodb')
-s3 = boto3.client('s3')
-lambda_client = boto3.client('lambda')
-
-clients_table = dynamodb.Table('Clients')
-products_table = dynamodb.Table('Products')
-sales_notes_table = dynamodb.Table('SalesNotes')
-sales_note_items_table = dynamodb.Table('SalesNoteItems')
-addresses_table = dynamodb.Table('Addresses')
+from schema import OUTBOX_INDEX, OUTBOX_TABLE, SALES_NOTE_ITEMS_INDEX, SALES_NOTES_CLIENT_INDEX, SALES_NOTES_FOLIO_INDEX
+import render_queue
+import rollups
+import unique_keys
+from cache import get_cache, sync_versions
+from aws import lazy
+from router import Router
+from json_encoding import dumps
+from tracing import instrument_client, span, trace_request, traced
+
+def _traced_dynamodb():
+    resource = aws.resource('dynamodb')
+    instrument_client(resource.meta.client)
+    return resource
+
+dynamodb = lazy(_traced_dynamodb)
+s3 = lazy(lambda: instrument_client(aws.client('s3')))
+lambda_client = lazy(lambda: instrument_client(aws.client('lambda')))
+
+clients_table = lazy(lambda: dynamodb.Table('Clients'))
+products_table = lazy(lambda: dynamodb.Table('Products'))
+sales_notes_table = lazy(lambda: dynamodb.Table('SalesNotes'))
+sales_note_items_table = lazy(lambda: dynamodb.Table('SalesNoteItems'))
+addresses_table = lazy(lambda: dynamodb.Table('Addresses'))
+render_jobs_table = lazy(lambda: dynamodb.Table('RenderJobs'))
+pdf_downloads_table = lazy(lambda: dynamodb.Table('PdfDownloads'))
+notifications_outbox_table = lazy(lambda: dynamodb.Table(OUTBOX_TABLE))
+
+# read-through caches for warm containers, invalidated by catalog writes
+clients_cache = get_cache('Clients')
+products_cache = get_cache('Products')
 
 BUCKET_NAME = '750924-esi3898k-examen2'
-NOTIFICATIONS_LAMBDA_NAME = 'notifications'
+BATCH_GET_LIMIT = 100
+TRANSACTION_LIMIT = 100
+REPORT_WORKERS = 8
+# new folios are random; a collision with an existing one is retried with another
+FOLIO_ATTEMPTS = 5
+DEFAULT_PAGE_SIZE = 50
+MAX_PAGE_SIZE = 500
+RENDER_MODE = os.getenv('RENDER_MODE', 'sync')
+# PDFs up to this size are returned inline (base64); larger ones redirect to a presigned URL
+PDF_INLINE_MAX_BYTES = int(os.getenv('PDF_INLINE_MAX_BYTES', str(1024 * 1024)))
+PDF_URL_EXPIRES_SECONDS = int(os.getenv('PDF_URL_EXPIRES_SECONDS', '300'))
+# notes with at least this many items render to a spooled temp file and upload in parts
+PDF_STREAM_MIN_ROWS = int(os.getenv('PDF_STREAM_MIN_ROWS', '1000'))
+PDF_SPOOL_MAX_BYTES = 8 * 1024 * 1024
+PDF_CLIENT_FIELDS = ['RazonSocial', 'NombreComercial', 'RFC', 'CorreoElectronico', 'Telefono']
+# outbox rows still waiting for their PDF this long after the item write are rendered again
+OUTBOX_SWEEP_AFTER_SECONDS = int(os.getenv('OUTBOX_SWEEP_AFTER_SECONDS', '900'))
+OUTBOX_SWEEP_LIMIT = int(os.getenv('OUTBOX_SWEEP_LIMIT', '25'))
 
-cloudwatch = boto3.client("cloudwatch")
-ENV = os.getenv("ENVIRONMENT", "local")
-def instrumented(handler):
-    def wrapper(event, context):
-        start = time.time()
+def send_metric(name, value, unit="Count"):
+    metrics.put(name, value, unit)
 
-        try:
-            response = handler(event, context)
-        except Exception as e:
-            send_metric("HTTP_5XX", 1)
-            raise
+router = Router()
 
-        duration = (time.time() - start) * 1000
+@instrumented
+@trace_request
+def lambda_handler(event, context):
+    sync_versions()
+    try:
+        return router.dispatch(event, context)
+    except Exception as e:
+        return {'statusCode': 500, 'body': json.dumps({'error': str(e)})}
 
-        status = response.get("statusCode", 200)
-        if 200 <= status < 300:
-            send_metric("HTTP_2XX", 1)
-        elif 400 <= status < 500:
-            send_metric("HTTP_4XX", 1)
+@router.action('reconcile_total')
+def reconcile_total_action(event, context):
+    total = reconcile_total(event['SalesNoteID'])
+    return {'statusCode': 200, 'body': dumps({'SalesNoteID': event['SalesNoteID'], 'Total': total})}
+
+@router.action('sweep_outbox')
+def sweep_outbox_action(event, context):
+    return {'statusCode': 200, 'body': json.dumps(sweep_outbox())}
+
+@router.route('POST', '/sales_notes', required=['ClienteID', 'DireccionFacturacionID', 'DireccionEnvioID'])
+def post_sales_note(event, params, body):
+    return create_sales_note(body)
+
+@router.route('GET', '/sales_notes/{id}')
+def get_sales_note(event, params, body):
+    note_id = params['id']
+    note_resp = sales_notes_table.get_item(Key={'ID': note_id})
+    if 'Item' not in note_resp:
+         return {'statusCode': 404, 'body': json.dumps({'error': 'Note not found'})}
+    return note_response(note_resp['Item'])
+
+@router.route('GET', '/sales_notes/folio/{folio}')
+def get_sales_note_by_folio(event, params, body):
+    response = sales_notes_table.query(
+        IndexName=SALES_NOTES_FOLIO_INDEX,
+        KeyConditionExpression=Key('Folio').eq(params['folio']),
+        Limit=1
+    )
+    if not response['Items']:
+        return {'statusCode': 404, 'body': json.dumps({'error': f"No note with folio {params['folio']}"})}
+    return note_response(response['Items'][0])
+
+@router.route('GET', '/sales_notes')
+def list_client_sales_notes(event, params, body):
+    """One page of a client's notes, in no particular order: ?cliente_id=...&limit=...&next=..."""
+    query = event.get('queryStringParameters') or {}
+    if not query.get('cliente_id'):
+        return {'statusCode': 400, 'body': json.dumps({'error': 'Missing cliente_id'})}
+    try:
+        limit = min(int(query.get('limit', DEFAULT_PAGE_SIZE)), MAX_PAGE_SIZE)
+    except ValueError:
+        return {'statusCode': 400, 'body': json.dumps({'error': 'limit must be an integer'})}
+    if limit < 1:
+        return {'statusCode': 400, 'body': json.dumps({'error': 'limit must be positive'})}
+    query_kwargs = {
+        'IndexName': SALES_NOTES_CLIENT_INDEX,
+        'KeyConditionExpression': Key('ClienteID').eq(query['cliente_id']),
+        'Limit': limit
+    }
+    if query.get('next'):
+        try:
+            query_kwargs['ExclusiveStartKey'] = json.loads(base64.urlsafe_b64decode(query['next'].encode('ascii')))
+        except (ValueError, TypeError):
+            return {'statusCode': 400, 'body': json.dumps({'error': 'Invalid next token'})}
+    response = sales_notes_table.query(**query_kwargs)
+    last_key = response.get('LastEvaluatedKey')
+    return {'statusCode': 200, 'body': dumps({
+        'Items': response['Items'],
+        'next': base64.urlsafe_b64encode(dumps(last_key).encode('utf-8')).decode('ascii') if last_key else None
+    })}
+
+def note_response(note):
+    items = query_note_items(note['ID'])
+
+    client = get_client(note['ClienteID']) or {}
+
+    response = {
+        'Note': note,
+        'Items': items,
+        'Client': client
+    }
+    return {'statusCode': 200, 'body': dumps(response)}
+
+@router.route('POST', '/sales_note_items', required=['SalesNoteID', 'Items'])
+def post_sales_note_items(event, params, body):
+    note_id = body['SalesNoteID']
+    note = sales_notes_table.get_item(Key={'ID': note_id}).get('Item')
+    if not note:
+        return {'statusCode': 404, 'body': json.dumps({'error': f'Sales note {note_id} not found'})}
+    rows, products, errors = validate_note_items(note_id, body['Items'])
+    if errors:
+        return {'statusCode': 400, 'body': json.dumps({'error': 'Invalid items', 'details': errors})}
+    render_async = RENDER_MODE == 'async' or body.get('Async')
+    if render_async and not render_queue.configured():
+        # without a queue the job would stay queued forever
+        return {'statusCode': 503, 'body': json.dumps({'error': 'Async rendering is not available: no render queue is configured'})}
+    write_note_items(note, rows)
+    if body.get('Reconcile'):
+        request_reconcile(note_id)
+
+    if render_async:
+        job = create_render_job(note_id)
+        return {
+            'statusCode': 202,
+            'body': json.dumps({'JobID': job['ID'], 'Estado': job['Estado'], 'status_url': f'/render_jobs/{job["ID"]}'})
+        }
+
+    veces_enviado = publish_note_pdf(note, products)
+    return {
+        'statusCode': 200,
+        'body': json.dumps({'message': f'PDF actualizado y notificacion enviada. Veces enviado: {veces_enviado}'})
+    }
+
+@router.route('GET', '/render_jobs/{id}')
+def get_render_job(event, params, body):
+    job_id = params['id']
+    job = render_jobs_table.get_item(Key={'ID': job_id}).get('Item')
+    if not job:
+        return {'statusCode': 404, 'body': json.dumps({'error': f'Render job {job_id} not found'})}
+    return {'statusCode': 200, 'body': dumps(job)}
+
+@router.route('GET', '/pdf_note/{id}')
+def get_pdf_note(event, params, body):
+    note_id = params['id']
+    note_resp = sales_notes_table.get_item(Key={'ID': note_id})
+    note = note_resp.get('Item')
+    if not note:
+        return {'statusCode': 404, 'body': json.dumps({'error': f'Sales note {note_id} not found'})}
+
+    client = get_client(note.get('ClienteID'))
+    if not client:
+        return {'statusCode': 404, 'body': json.dumps({'error': f'Client {note.get("ClienteID")} not found'})}
+
+    s3_key = f"{client['RFC']}/{note['Folio']}.pdf"
+    filename = f'{note["Folio"]}.pdf'
+    try:
+        pdf_size = record_pdf_download(s3_key, note_id)
+        if pdf_size > PDF_INLINE_MAX_BYTES:
+            # large PDFs are fetched by the client straight from S3
+            url = s3.generate_presigned_url(
+                'get_object',
+                Params={
+                    'Bucket': BUCKET_NAME,
+                    'Key': s3_key,
+                    'ResponseContentType': 'application/pdf',
+                    'ResponseContentDisposition': f'attachment; filename="{filename}"'
+                },
+                ExpiresIn=PDF_URL_EXPIRES_SECONDS
+            )
+            return {'statusCode': 302, 'headers': {'Location': url, 'Cache-Control': 'no-store'}, 'body': ''}
+
+        pdf_data = s3.get_object(Bucket=BUCKET_NAME, Key=s3_key)['Body'].read()  # bytes
+        encoded_body = base64.b64encode(pdf_data).decode('utf-8')
+
+        return {
+            'statusCode': 200,
+            'headers': {
+                'Content-Type': 'application/pdf',
+                'Content-Disposition': f'attachment; filename="{filename}"'
+            },
+            'body': encoded_body,
+            'isBase64Encoded': True
+        }
+
+    except ClientError as e:
+        code = e.response.get('Error', {}).get('Code', '')
+        if code in ('NoSuchKey', '404', 'NotFound'):
+            return {'statusCode': 404, 'body': json.dumps({'error': 'PDF not found'})}
+        return {'statusCode': 500, 'body': json.dumps({'error': 'S3 error', 'details': str(e)})}
+
+@router.route('GET', '/reports/sales')
+def get_sales_report(event, params, body):
+    """Revenue per cliente, producto or dia between desde and hasta (inclusive, YYYY-MM-DD)."""
+    query = event.get('queryStringParameters') or {}
+    group_by = query.get('group_by', 'dia')
+    if group_by not in rollups.GROUP_BYS:
+        return {'statusCode': 400, 'body': json.dumps({'error': 'group_by must be one of ' + ', '.join(rollups.GROUP_BYS)})}
+    try:
+        hasta = date.fromisoformat(query['hasta']) if query.get('hasta') else datetime.utcnow().date()
+        desde = date.fromisoformat(query['desde']) if query.get('desde') else hasta - timedelta(days=30)
+    except ValueError:
+        return {'statusCode': 400, 'body': json.dumps({'error': 'desde and hasta must be dates (YYYY-MM-DD)'})}
+    if desde > hasta or (hasta - desde).days >= rollups.MAX_REPORT_DAYS:
+        return {'statusCode': 400, 'body': json.dumps({'error': f'desde must be before hasta and at most {rollups.MAX_REPORT_DAYS} days apart'})}
+
+    partitions = rollups.report_partitions(group_by, desde, hasta)
+    with span('rollup_query'), ThreadPoolExecutor(max_workers=min(REPORT_WORKERS, len(partitions))) as executor:
+        rows = [row for rows in executor.map(lambda p: rollups.query_partition(dynamodb.meta.client, *p), partitions) for row in rows]
+    groups = rollups.merge(rows)
+    if group_by == 'dia':
+        groups.sort(key=lambda g: g['Clave'])
+    elif group_by == 'cliente':
+        clients = resolve_clients(g['Clave'] for g in groups)
+        for g in groups:
+            g['Nombre'] = clients.get(g['Clave'], {}).get('RazonSocial')
+    else:
+        products = resolve_products(g['Clave'] for g in groups)
+        for g in groups:
+            g['Nombre'] = products.get(g['Clave'], {}).get('Nombre')
+    return {'statusCode': 200, 'body': dumps({
+        'group_by': group_by,
+        'desde': desde.isoformat(),
+        'hasta': hasta.isoformat(),
+        'Groups': groups
+    })}
+
+def create_sales_note(body):
+    """Validate the note's references with one batch read, then create it in one transaction.
+
+    The transaction re-checks the client and both addresses, so a concurrent
+    DELETE in the catalogs Lambda cannot leave the new note orphaned.
+    """
+    client_key = {'ID': body['ClienteID']}
+    billing_key = {'ID': body['DireccionFacturacionID']}
+    shipping_key = {'ID': body['DireccionEnvioID']}
+    addresses = batch_get('Addresses', [billing_key['ID'], shipping_key['ID']])
+    billing = addresses.get(billing_key['ID'])
+    shipping = addresses.get(shipping_key['ID'])
+    if client_key['ID'] not in batch_get('Clients', [client_key['ID']]):
+        return {'statusCode': 400, 'body': json.dumps({'error': f"Client {body['ClienteID']} not found"})}
+    if not billing:
+        return {'statusCode': 400, 'body': json.dumps({'error': f"Billing Address {body['DireccionFacturacionID']} not found"})}
+    if billing.get('TipoDireccion') != 'Facturacion':
+        return {'statusCode': 400, 'body': json.dumps({'error': f"Address {body['DireccionFacturacionID']} is not a billing address"})}
+    if not shipping:
+        return {'statusCode': 400, 'body': json.dumps({'error': f"Shipping Address {body['DireccionEnvioID']} not found"})}
+    if shipping.get('TipoDireccion') != 'Envio':
+        return {'statusCode': 400, 'body': json.dumps({'error': f"Address {body['DireccionEnvioID']} is not a shipping address"})}
+
+    note_id = str(uuid.uuid4())
+    note = {
+        'ID': note_id,
+        'ClienteID': body['ClienteID'],
+        'DireccionFacturacionID': body['DireccionFacturacionID'],
+        'DireccionEnvioID': body['DireccionEnvioID'],
+        'Total': Decimal(0),
+        'Fecha': datetime.utcnow().isoformat()
+    }
+    for attempt in range(FOLIO_ATTEMPTS):
+        note['Folio'] = str(uuid.uuid4())[:8]
+        error = put_sales_note(note, body, client_key, billing_key, shipping_key)
+        if error != 'folio':
+            break
+        send_metric('FolioCollisions', 1)
+    else:
+        raise Exception(f'No free folio after {FOLIO_ATTEMPTS} attempts')
+    if error:
+        return {'statusCode': 409, 'body': json.dumps({'error': error})}
+    return {'statusCode': 200, 'body': json.dumps({'ID': note_id, 'Folio': note['Folio']})}
+
+def put_sales_note(note, body, client_key, billing_key, shipping_key):
+    """Create the note and claim its folio in one transaction.
+
+    Returns None, 'folio' when the folio is taken, or the message of the
+    reference that changed.
+    """
+    transact_items = [
+        {'ConditionCheck': {
+            'TableName': 'Clients',
+            'Key': client_key,
+            'ConditionExpression': 'attribute_exists(ID)'
+        }},
+        {'ConditionCheck': {
+            'TableName': 'Addresses',
+            'Key': billing_key,
+            'ConditionExpression': 'attribute_exists(ID) AND TipoDireccion = :tipo',
+            'ExpressionAttributeValues': {':tipo': 'Facturacion'}
+        }},
+        {'ConditionCheck': {
+            'TableName': 'Addresses',
+            'Key': shipping_key,
+            'ConditionExpression': 'attribute_exists(ID) AND TipoDireccion = :tipo',
+            'ExpressionAttributeValues': {':tipo': 'Envio'}
+        }},
+        {'Put': {
+            'TableName': 'SalesNotes',
+            'Item': note,
+            'ConditionExpression': 'attribute_not_exists(ID)'
+        }},
+        unique_keys.claim('Folio', note['Folio'], note['ID'])
+    ]
+    try:
+        dynamodb.meta.client.transact_write_items(TransactItems=transact_items)
+    except ClientError as e:
+        failed = unique_keys.failed_checks(e)
+        messages = [
+            f"Client {body['ClienteID']} not found",
+            f"Billing Address {body['DireccionFacturacionID']} changed or was deleted",
+            f"Shipping Address {body['DireccionEnvioID']} changed or was deleted"
+        ]
+        for i in failed:
+            if i < len(messages):
+                return messages[i]
+        if len(transact_items) - 1 in failed:
+            return 'folio'
+        raise
+    return None
+
+def publish_note_pdf(note, products=None):
+    """Render the note PDF, upload it to S3 and notify the client.
+
+    Returns the new veces-enviado count. Shared by the synchronous request
+    path and render_worker.
+    """
+    products = dict(products or {})
+    note_id = note['ID']
+    # the caller's copy predates the item writes; ItemCount tells when the index has them all
+    note, all_items = read_note_items(note_id)
+    if not note:
+        raise Exception(f'Sales note {note_id} not found')
+    client = get_client(note['ClienteID'])
+    if not client:
+        raise Exception(f"Client {note['ClienteID']} not found")
+    products.update(resolve_products(i['ProductoID'] for i in all_items if i['ProductoID'] not in products))
+    all_items.sort(key=lambda i: (i['ProductoID'], i['ID']))
+    render_hash = compute_render_hash(client, note['Folio'], all_items, products)
+
+    s3_key = f"{client['RFC']}/{note['Folio']}.pdf"
+    hora_envio = datetime.utcnow().isoformat()
+    if note.get('RenderHash') == render_hash:
+        # same client data, folio and items: the stored PDF is already current
+        send_metric("PdfCacheHit", 1)
+        veces_enviado = int(note.get('VecesEnviado', 0))
+    else:
+        send_metric("PdfCacheMiss", 1)
+        veces_enviado = count_send(note['ID'], hora_envio)
+        metadata = {
+            'hora-envio': hora_envio,
+            'veces-enviado': str(veces_enviado),
+            'render-hash': render_hash
+        }
+        # large notes spill to /tmp instead of holding the whole PDF in memory
+        streaming = len(all_items) >= PDF_STREAM_MIN_ROWS
+        pdf_file = tempfile.SpooledTemporaryFile(max_size=PDF_SPOOL_MAX_BYTES) if streaming else BytesIO()
+        with pdf_file:
+            generate_pdf(client, note['Folio'], all_items, products, sink=pdf_file)
+            pdf_size = pdf_file.tell()
+            with span('s3_put'):
+                uploaded = put_pdf_if_newer(s3_key, pdf_file, metadata, veces_enviado)
+        if uploaded:
+            record_render_hash(note['ID'], render_hash, veces_enviado)
+            pdf_downloads_table.put_item(Item={
+                'ID': s3_key,
+                'SalesNoteID': note['ID'],
+                'Descargada': False,
+                'Descargas': 0,
+                'Tamano': pdf_size,
+                'SubidoEn': hora_envio
+            })
         else:
-            send_metric("HTTP_5XX", 1)
-
-        send_metric("LatencyMs", duration, unit="Milliseconds")
-
-        return response
-
-    return wrapper
-
-
-def send_metric(name, value, unit="Count"):
-    cloudwatch.put_metric_data(
-        Namespace=f"MyApp-{ENV}",
-        MetricData=[
-            {
-                "MetricName": name,
-                "Value": value,
-                "Unit": unit
+            # a later send already stored its PDF; the link below serves that one
+            send_metric("PdfUploadSuperseded", 1)
+
+    s3_link = f'https://41iqxbksll.execute-api.us-east-1.amazonaws.com/pdf_note/{note["ID"]}'
+    notification_payload = {
+        'client': client,
+        'folio': note['Folio'],
+        's3_link': s3_link
+    }
+
+    with span('notify'):
+        # notifications/outbox_relay.py sends it; the Version was bumped by the item writes
+        notifications_outbox_table.update_item(
+            Key={'ID': note['ID']},
+            UpdateExpression='SET Estado = :estado, Payload = :payload, ActualizadoEn = :now, Version = if_not_exists(Version, :zero)',
+            ExpressionAttributeValues={
+                ':estado': 'pendiente',
+                ':payload': notification_payload,
+                ':now': datetime.utcnow().isoformat(),
+                ':zero': 0
             }
-        ]
-    )
+        )
+    return veces_enviado
+
+def count_send(note_id, hora_envio):
+    """Count a new send of the note PDF and return the new VecesEnviado.
+
+    One ADD on the SalesNotes row replaces reading the counter from the S3
+    metadata, so concurrent sends never lose an increment.
+    """
+    with span('send_counter'):
+        response = sales_notes_table.update_item(
+            Key={'ID': note_id},
+            UpdateExpression='SET HoraEnvio = :hora ADD VecesEnviado :one',
+            ConditionExpression='attribute_exists(ID)',
+            ExpressionAttributeValues={':hora': hora_envio, ':one': 1},
+            ReturnValues='UPDATED_NEW'
+        )
+    return int(response['Attributes']['VecesEnviado'])
+
+def put_pdf_if_newer(s3_key, pdf_file, metadata, veces_enviado, max_attempts=5):
+    """Upload the PDF unless S3 already holds one from a later send.
+
+    Sends of the same note can finish out of order, so each put is
+    conditional on the object it looked at (its ETag, or no object at all);
+    if another send wrote in between, look again. Returns False when a later
+    send's PDF is already there.
+    """
+    for _ in range(max_attempts):
+        try:
+            current = s3.head_object(Bucket=BUCKET_NAME, Key=s3_key)
+        except ClientError as e:
+            if e.response['Error']['Code'] not in ('NoSuchKey', '404', 'NotFound'):
+                raise
+            current = None
+        if current and int(current['Metadata'].get('veces-enviado', 0)) > veces_enviado:
+            return False
+        condition = {'IfMatch': current['ETag']} if current else {'IfNoneMatch': '*'}
+        pdf_file.seek(0)
+        try:
+            # a plain put (up to 5 GB) so the write can be conditional;
+            # upload_fileobj's multipart uploads cannot take IfMatch
+            s3.put_object(Bucket=BUCKET_NAME, Key=s3_key, Body=pdf_file, Metadata=metadata, **condition)
+            return True
+        except ClientError as e:
+            if e.response['Error']['Code'] not in ('PreconditionFailed', 'ConditionalRequestConflict'):
+                raise
+    raise Exception(f'Could not upload {s3_key}: it kept changing for {max_attempts} attempts')
+
+def record_render_hash(note_id, render_hash, veces_enviado):
+    """Remember the hash of the PDF just uploaded, unless a later send got there first.
+
+    Only set once the upload succeeded, so a failed one never leaves the row
+    claiming a PDF that is not in S3.
+    """
+    try:
+        sales_notes_table.update_item(
+            Key={'ID': note_id},
+            UpdateExpression='SET RenderHash = :hash',
+            ConditionExpression='VecesEnviado = :count',
+            ExpressionAttributeValues={':hash': render_hash, ':count': veces_enviado}
+        )
+    except ClientError as e:
+        if e.response['Error']['Code'] != 'ConditionalCheckFailedException':
+            raise
 
-@instrumented
-def lambda_handler(event, context):
-    http_method = event.get("requestContext", {}).get("http", {}).get("method")
-    path = event.get("routeKey", "")
-    body = json.loads(event.get('body', '{}')) if event.get('body') else {}
+def record_pdf_download(s3_key, note_id):
+    """Mark the PDF as downloaded and return its size in bytes.
 
+    Download state lives in PdfDownloads instead of the object metadata, so
+    tracking a download is one conditional DynamoDB write rather than an S3
+    copy. PDFs uploaded before PdfDownloads existed get their record here.
+    """
+    now = datetime.utcnow().isoformat()
     try:
-        if '/sales_notes' in path:
-            if http_method == 'POST':
-                required_fields = ['ClienteID', 'DireccionFacturacionID', 'DireccionEnvioID']
-                if not all(field in body for field in required_fields):
-                    return {'statusCode': 400, 'body': json.dumps({'error': 'Missing required fields: ' + ', '.join([f for f in required_fields if f not in body])})}
-
-                client_resp = clients_table.get_item(Key={'ID': body['ClienteID']})
-                if 'Item' not in client_resp:
-                    return {'statusCode': 400, 'body': json.dumps({'error': f"Client {body['ClienteID']} not found"})}
-
-                billing_addr_resp = addresses_table.get_item(Key={'ID': body['DireccionFacturacionID']})
-                if 'Item' not in billing_addr_resp:
-                    return {'statusCode': 400, 'body': json.dumps({'error': f"Billing Address {body['DireccionFacturacionID']} not found"})}
-                if billing_addr_resp['Item'].get('TipoDireccion') != 'Facturacion':
-                    return {'statusCode': 400, 'body': json.dumps({'error': f"Address {body['DireccionFacturacionID']} is not a billing address"})}
-
-                shipping_addr_resp = addresses_table.get_item(Key={'ID': body['DireccionEnvioID']})
-                if 'Item' not in shipping_addr_resp:
-                    return {'statusCode': 400, 'body': json.dumps({'error': f"Shipping Address {body['DireccionEnvioID']} not found"})}
-                if shipping_addr_resp['Item'].get('TipoDireccion') != 'Envio':
-                    return {'statusCode': 400, 'body': json.dumps({'error': f"Address {body['DireccionEnvioID']} is not a shipping address"})}
-
-
-                note_id = str(uuid.uuid4())
-                folio = str(uuid.uuid4())[:8]
-                total = Decimal(str(0))
-                sales_notes_table.put_item(Item={
-                    'ID': note_id,
-                    'Folio': folio,
-                    'ClienteID': body['ClienteID'],
-                    'DireccionFacturacionID': body['DireccionFacturacionID'],
-                    'DireccionEnvioID': body['DireccionEnvioID'],
-                    'Total': total
-                })
-                return {'statusCode': 200, 'body': json.dumps({'ID': note_id, 'Folio': folio})}
-
-            elif http_method == 'GET':
-                note_id = event.get('pathParameters', {}).get('id')
-                if not note_id:
-                     return {'statusCode': 400, 'body': json.dumps({'error': 'Missing ID in path'})}
-                
-                note_resp = sales_notes_table.get_item(Key={'ID': note_id})
-                if 'Item' not in note_resp:
-                     return {'statusCode': 404, 'body': json.dumps({'error': 'Note not found'})}
-                note = note_resp['Item']
-                
-                items = sales_note_items_table.scan(
-                    FilterExpression='SalesNoteID = :snid',
-                    ExpressionAttributeValues={':snid': note_id}
-                )['Items']
-                
-                client = clients_table.get_item(Key={'ID': note['ClienteID']}).get('Item', {})
-                
-                response = {
-                    'Note': note,
-                    'Items': items,
-                    'Client': client
-                }
-                return {'statusCode': 200, 'body': json.dumps(decimal_to_native(response))}
-
-        elif '/sales_note_items' in path:
-            if http_method == 'POST':
-                required_fields = ['SalesNoteID', 'Items']
-                if not all(field in body for field in required_fields):
-                    return {'statusCode': 400, 'body': json.dumps({'error': 'Missing required fields: ' + ', '.join([f for f in required_fields if f not in body])})}
-                note_id = body['SalesNoteID']
-                items = body['Items']
-                for item in items:
-                    item_id = str(uuid.uuid4())
-                    sales_note_items_table.put_item(Item={
-                        'ID': item_id,
-                        'SalesNoteID': note_id,
-                        'ProductoID': item['ProductoID'],
-                        'Cantidad': int(item['Cantidad']),
-                        'PrecioUnitario': Decimal(str(item['PrecioUnitario'])),
-                        'Importe': Decimal(float(item['Cantidad']) * float(item['PrecioUnitario']))
-                    })
-                all_items = sales_note_items_table.scan(
-                    FilterExpression='SalesNoteID = :snid',
-                    ExpressionAttributeValues={':snid': note_id}
-                )['Items']
-                total = sum(float(i['Importe']) for i in all_items)
-                sales_notes_table.update_item(
-                    Key={'ID': note_id},
-                    UpdateExpression='SET #t = :t',
-                    ExpressionAttributeNames={'#t': 'Total'},
-                    ExpressionAttributeValues={':t': Decimal(total)}
-                )
-
-                note = sales_notes_table.get_item(Key={'ID': note_id})['Item']
-                client = clients_table.get_item(Key={'ID': note['ClienteID']})['Item']
-                pdf_buffer = generate_pdf(client, note['Folio'], all_items)
-
-                s3_key = f"{client['RFC']}/{note['Folio']}.pdf"
-                veces_enviado = 0
-                try:
-                    existing_obj = s3.head_object(Bucket=BUCKET_NAME, Key=s3_key)
-                    existing_metadata = existing_obj.get('Metadata', {})
-                    veces_enviado = int(existing_metadata.get('veces-enviado', '0')) + 1
-                except ClientError as e:
-                    if e.response['Error']['Code'] == '404':
-                        veces_enviado = 1
-                    else:
-                        raise
-
-                s3.put_object(
-                    Bucket=BUCKET_NAME,
-                    Key=s3_key,
-                    Body=pdf_buffer.getvalue(),
-                    Metadata={
-                        'hora-envio': datetime.utcnow().isoformat(),
-                        'nota-descargada': 'false',
-                        'veces-enviado': str(veces_enviado)
-                    }
-                )
-
-                s3_link = f'https://41iqxbksll.execute-api.us-east-1.amazonaws.com/pdf_note/{note_id}'
-                notification_payload = {
-                    'client': decimal_to_native(client),
-                    'folio': note['Folio'],
-                    's3_link': s3_link
-                }
-                
-                lambda_client.invoke(
-                    FunctionName=NOTIFICATIONS_LAMBDA_NAME,
-                    InvocationType='Event',
-                    Payload=json.dumps(notification_payload).encode('utf-8')
-                )
-
-                return {
-                    'statusCode': 200,
-                    'body': json.dumps({'message': f'PDF actualizado y notificacion enviada. Veces enviado: {veces_enviado}'})
-                }
+        record = pdf_downloads_table.update_item(
+            Key={'ID': s3_key},
+            UpdateExpression='SET Descargada = :t, UltimaDescarga = :now ADD Descargas :one',
+            ConditionExpression='attribute_exists(ID)',
+            ExpressionAttributeValues={':t': True, ':now': now, ':one': 1},
+            ReturnValues='ALL_NEW'
+        )['Attributes']
+        return int(record['Tamano'])
+    except ClientError as e:
+        if e.response['Error']['Code'] != 'ConditionalCheckFailedException':
+            raise
 
-        elif '/pdf_note' in path and http_method == 'GET':
-            note_id = event.get('pathParameters', {}).get('id')
-            if not note_id:
-                return {'statusCode': 400, 'body': json.dumps({'error': 'Missing ID parameter'})}
-            note_resp = sales_notes_table.get_item(Key={'ID': note_id})
-            note = note_resp.get('Item')
-            if not note:
-                return {'statusCode': 404, 'body': json.dumps({'error': f'Sales note {note_id} not found'})}
-
-            client_resp = clients_table.get_item(Key={'ID': note.get('ClienteID')})
-            client = client_resp.get('Item')
-            if not client:
-                return {'statusCode': 404, 'body': json.dumps({'error': f'Client {note.get("ClienteID")} not found'})}
-
-            s3_key = f"{client['RFC']}/{note['Folio']}.pdf"
-
-            try:
-                pdf_obj = s3.get_object(Bucket=BUCKET_NAME, Key=s3_key)
-                pdf_data = pdf_obj['Body'].read()  # bytes
-
-                new_metadata = dict(pdf_obj.get('Metadata', {}))
-                new_metadata['nota-descargada'] = 'true'
-
-                s3.copy_object(
-                    Bucket=BUCKET_NAME,
-                    CopySource={'Bucket': BUCKET_NAME, 'Key': s3_key},
-                    Key=s3_key,
-                    Metadata=new_metadata,
-                    MetadataDirective='REPLACE'
-                )
-
-                encoded_body = base64.b64encode(pdf_data).decode('utf-8')
-
-                return {
-                    'statusCode': 200,
-                    'headers': {
-                        'Content-Type': 'application/pdf',
-                        'Content-Disposition': f'attachment; filename="{note["Folio"]}.pdf"'
-                    },
-                    'body': encoded_body,
-                    'isBase64Encoded': True
+    pdf_head = s3.head_object(Bucket=BUCKET_NAME, Key=s3_key)
+    pdf_downloads_table.put_item(Item={
+        'ID': s3_key,
+        'SalesNoteID': note_id,
+        'Descargada': True,
+        'Descargas': 1,
+        'Tamano': pdf_head['ContentLength'],
+        'UltimaDescarga': now
+    })
+    return pdf_head['ContentLength']
+
+@traced('render_hash')
+def compute_render_hash(client, folio, items, products):
+    """Stable hash of everything generate_pdf puts on the page."""
+    content = {
+        'client': [str(client.get(field, '')) for field in PDF_CLIENT_FIELDS],
+        'folio': folio,
+        'items': sorted(
+            [str(i['ProductoID']), products[i['ProductoID']]['Nombre'], str(i['Cantidad']), str(i['PrecioUnitario']), str(i['Importe'])]
+            for i in items
+        )
+    }
+    return hashlib.sha256(json.dumps(content, sort_keys=True).encode('utf-8')).hexdigest()
+
+def create_render_job(note_id):
+    now = datetime.utcnow().isoformat()
+    job = {
+        'ID': str(uuid.uuid4()),
+        'SalesNoteID': note_id,
+        'Estado': 'queued',
+        'Intentos': 0,
+        'CreadoEn': now,
+        'ActualizadoEn': now
+    }
+    render_jobs_table.put_item(Item=job)
+    render_queue.enqueue({'JobID': job['ID'], 'SalesNoteID': note_id})
+    return job
+
+def parse_cantidad(value):
+    """A quantity as an int, or None unless it is a whole number.
+
+    int() would truncate 2.7 to 2 and read true as 1, and the Importe would
+    be computed from that instead of being rejected.
+    """
+    if isinstance(value, bool):
+        return None
+    if isinstance(value, int):
+        return value
+    if not isinstance(value, (str, float)):
+        return None
+    try:
+        number = Decimal(str(value).strip())
+    except ArithmeticError:
+        return None
+    if not number.is_finite() or number != number.to_integral_value():
+        return None
+    if number.adjusted() >= 38:
+        # past DynamoDB's 38 digits; reported like any other out-of-range amount
+        raise OverflowError(value)
+    return int(number)
+
+@traced('validate_items')
+def validate_note_items(note_id, items):
+    if not isinstance(items, list) or not items:
+        return [], {}, [{'index': None, 'error': 'Items must be a non-empty list'}]
+
+    rows = []
+    row_indexes = []
+    errors = []
+    for index, item in enumerate(items):
+        try:
+            cantidad = parse_cantidad(item['Cantidad'])
+            if cantidad is None:
+                errors.append({'index': index, 'error': 'Cantidad must be a whole number'})
+                continue
+            # DynamoDB's context traps values it cannot store exactly (over 38
+            # digits, exponents out of range); NaN and Infinity are not numbers to it
+            precio_unitario = DYNAMODB_CONTEXT.create_decimal(str(item['PrecioUnitario']))
+            if not precio_unitario.is_finite():
+                raise ValueError(precio_unitario)
+            rows.append({
+                'ID': str(uuid.uuid4()),
+                'SalesNoteID': note_id,
+                'ProductoID': item['ProductoID'],
+                'Cantidad': cantidad,
+                'PrecioUnitario': precio_unitario,
+                'Importe': DYNAMODB_CONTEXT.multiply(Decimal(cantidad), precio_unitario)
+            })
+            row_indexes.append(index)
+        except KeyError as e:
+            errors.append({'index': index, 'error': f'Missing field {e.args[0]}'})
+        except (TypeError, ValueError):
+            errors.append({'index': index, 'error': 'Cantidad and PrecioUnitario must be numeric'})
+        except ArithmeticError:
+            errors.append({'index': index, 'error': 'Cantidad and PrecioUnitario are out of the range of DynamoDB numbers'})
+
+    products = resolve_products(row['ProductoID'] for row in rows)
+    for index, row in zip(row_indexes, rows):
+        if row['ProductoID'] not in products:
+            errors.append({'index': index, 'error': f"Product {row['ProductoID']} not found"})
+    errors.sort(key=lambda error: error['index'])
+    return rows, products, errors
+
+@traced('write_items')
+def write_note_items(note, rows):
+    # every chunk updates the same note row, so parallel chunks would only conflict
+    for chunk in chunk_note_items(rows):
+        write_items_transaction(note, chunk)
+
+def chunk_note_items(rows):
+    """Split rows so each transaction fits in TRANSACTION_LIMIT operations.
+
+    Besides one Put per row, a transaction updates the note and its outbox row.
+    """
+    size = TRANSACTION_LIMIT - 2
+    return [rows[start:start + size] for start in range(0, len(rows), size)]
+
+def write_items_transaction(note, rows, max_retries=10):
+    """Write one chunk of items and ADD its Importe sum to the note Total atomically.
+
+    The same transaction bumps the note's outbox Version and leaves the row
+    'esperando-pdf', so a change that is written leaves a notification owed
+    even if the Lambda dies before the PDF is published: sweep_outbox renders
+    it later. The sales rollups are updated from the items' stream by
+    rollup_stream.py, off the request path.
+    """
+    note_id = note['ID']
+    delta = sum((row['Importe'] for row in rows), Decimal(0))
+    transact_items = [{'Put': {'TableName': 'SalesNoteItems', 'Item': row}} for row in rows]
+    transact_items.append({'Update': {
+        'TableName': 'SalesNotes',
+        'Key': {'ID': note_id},
+        'UpdateExpression': 'ADD #t :delta, ItemCount :count',
+        'ConditionExpression': 'attribute_exists(ID)',
+        'ExpressionAttributeNames': {'#t': 'Total'},
+        'ExpressionAttributeValues': {':delta': delta, ':count': len(rows)}
+    }})
+    transact_items.append({'Update': {
+        'TableName': OUTBOX_TABLE,
+        'Key': {'ID': note_id},
+        'UpdateExpression': 'SET Estado = :estado, ActualizadoEn = :now ADD Version :one',
+        'ExpressionAttributeValues': {':estado': 'esperando-pdf', ':now': datetime.utcnow().isoformat(), ':one': 1}
+    }})
+    # the token makes a retry after an ambiguous failure apply the chunk only once
+    token = str(uuid.uuid4())
+    attempt = 0
+    while True:
+        try:
+            # the resource's client is thread-safe and still (de)serializes items
+            dynamodb.meta.client.transact_write_items(TransactItems=transact_items, ClientRequestToken=token)
+            return
+        except ClientError as e:
+            if not retryable_transaction_error(e) or attempt >= max_retries:
+                raise
+            time.sleep(random.uniform(0, 0.05 * (2 ** attempt)))
+            attempt += 1
+
+def sweep_outbox(limit=OUTBOX_SWEEP_LIMIT):
+    """Render again the notes whose outbox row is stuck in 'esperando-pdf'.
+
+    Such a row means the items were written but the request or render job
+    that should have published the PDF died. Run it on a schedule (e.g.
+    every 5 minutes) with {"action": "sweep_outbox"}. Each row is claimed
+    by moving its ActualizadoEn forward, so concurrent sweeps skip it and a
+    render that fails again is retried after another OUTBOX_SWEEP_AFTER_SECONDS.
+    """
+    cutoff = (datetime.utcnow() - timedelta(seconds=OUTBOX_SWEEP_AFTER_SECONDS)).isoformat()
+    rows = notifications_outbox_table.query(
+        IndexName=OUTBOX_INDEX,
+        KeyConditionExpression=Key('Estado').eq('esperando-pdf') & Key('ActualizadoEn').lt(cutoff),
+        Limit=limit
+    )['Items']
+    stats = {'Stale': len(rows), 'Queued': 0, 'Published': 0, 'Failed': 0}
+    for row in rows:
+        try:
+            notifications_outbox_table.update_item(
+                Key={'ID': row['ID']},
+                UpdateExpression='SET ActualizadoEn = :now',
+                ConditionExpression='Estado = :estado AND ActualizadoEn = :seen',
+                ExpressionAttributeValues={
+                    ':now': datetime.utcnow().isoformat(),
+                    ':estado': 'esperando-pdf',
+                    ':seen': row['ActualizadoEn']
                 }
+            )
+        except ClientError as e:
+            if e.response['Error']['Code'] != 'ConditionalCheckFailedException':
+                raise
+            # published, rewritten or claimed by another sweep since the query
+            continue
+        try:
+            if render_queue.configured():
+                create_render_job(row['ID'])
+                stats['Queued'] += 1
+            else:
+                publish_note_pdf({'ID': row['ID']})
+                stats['Published'] += 1
+        except Exception as e:
+            print(f"Error sweeping outbox row {row['ID']}: {e}")
+            stats['Failed'] += 1
+    send_metric('OutboxSwept', stats['Queued'] + stats['Published'])
+    if stats['Failed']:
+        send_metric('OutboxSweepFailed', stats['Failed'])
+    return stats
+
+def retryable_transaction_error(error):
+    """True for conflicts and throttling; validation and condition failures fail the same way again."""
+    code = error.response['Error']['Code']
+    if code != 'TransactionCanceledException':
+        return code in ('TransactionConflictException', 'ThrottlingException', 'ProvisionedThroughputExceededException')
+    # operations that were fine are listed with the code 'None'
+    reasons = {r.get('Code') for r in error.response.get('CancellationReasons', [])} - {'None', None}
+    return bool(reasons) and reasons <= {'TransactionConflict', 'ThrottlingError'}
+
+def request_reconcile(note_id):
+    lambda_client.invoke(
+        FunctionName=os.getenv('AWS_LAMBDA_FUNCTION_NAME', 'sales'),
+        InvocationType='Event',
+        Payload=json.dumps({'action': 'reconcile_total', 'SalesNoteID': note_id}).encode('utf-8')
+    )
 
-            except ClientError as e:
-                code = e.response.get('Error', {}).get('Code', '')
-                if code in ('NoSuchKey', '404', 'NotFound'):
-                    return {'statusCode': 404, 'body': json.dumps({'error': 'PDF not found'})}
-                return {'statusCode': 500, 'body': json.dumps({'error': 'S3 error', 'details': str(e)})}
-
-        return {'statusCode': 400, 'body': json.dumps({'error': 'Invalid path or method'})}
-
-    except Exception as e:
-        return {'statusCode': 500, 'body': json.dumps({'error': str(e)})}
-
-def generate_pdf(client, folio, items):
-    buffer = BytesIO()
-    doc = SimpleDocTemplate(buffer, pagesize=letter)
-    elements = []
-    styles = getSampleStyleSheet()
-
-    elements.append(Paragraph("Client Information", styles['Heading1']))
-    client_data = [
-        ['Razon Social', client['RazonSocial']],
-        ['Nombre Comercial', client['NombreComercial']],
-        ['RFC', client['RFC']],
-        ['Correo', client['CorreoElectronico']],
-        ['Telefono', client['Telefono']]
-    ]
-    client_table = Table(client_data)
-    client_table.setStyle(TableStyle([
-        ('GRID', (0,0), (-1,-1), 1, colors.black),
-        ('FONT', (0,0), (-1,-1), 'Helvetica', 10)
-    ]))
-    elements.append(client_table)
-
-    elements.append(Paragraph(f"Note Folio: {folio}", styles['Heading2']))
-
-    items_data = [['Cantidad', 'Producto', 'Precio Unitario', 'Importe']]
-    for item in items:
-        product = products_table.get_item(Key={'ID': item['ProductoID']})['Item']
-        items_data.append([
-            str(item['Cantidad']),
-            product['Nombre'],
-            f"${item['PrecioUnitario']:.2f}",
-            f"${item['Importe']:.2f}"
-        ])
-    items_table = Table(items_data)
-    items_table.setStyle(TableStyle([
-        ('GRID', (0,0), (-1,-1), 1, colors.black),
-        ('FONT', (0,0), (-1,-1), 'Helvetica', 10),
-        ('BACKGROUND', (0,0), (-1,0), colors.grey),
-        ('TEXTCOLOR', (0,0), (-1,0), colors.whitesmoke)
-    ]))
-    elements.append(items_table)
-
-    doc.build(elements)
-    return buffer
-
-def decimal_to_native(obj):
-    if isinstance(obj, list):
-        return [decimal_to_native(i) for i in obj]
-    elif isinstance(obj, dict):
-        return {k: decimal_to_native(v) for k, v in obj.items()}
-    elif isinstance(obj, Decimal):
-        return int(obj) if obj % 1 == 0 else float(obj)
-    return obj
+def reconcile_total(note_id, max_retries=5):
+    """Recompute a note's Total from its items.
+
+    The write is conditioned on the Total and ItemCount read beforehand, so a
+    concurrent append (or an index that has not caught up yet) makes it retry
+    instead of overwriting a newer value.
+    """
+    for attempt in range(max_retries + 1):
+        note, items = read_note_items(note_id)
+        if not note:
+            return None
+        total = sum((i['Importe'] for i in items), Decimal(0))
+        try:
+            sales_notes_table.update_item(
+                Key={'ID': note_id},
+                UpdateExpression='SET #t = :t, ItemCount = :count',
+                ConditionExpression='#t = :old AND (attribute_not_exists(ItemCount) OR ItemCount = :old_count)',
+                ExpressionAttributeNames={'#t': 'Total'},
+                ExpressionAttributeValues={
+                    ':t': total,
+                    ':count': len(items),
+                    ':old': note['Total'],
+                    ':old_count': note.get('ItemCount', len(items))
+                }
+            )
+            return total
+        except ClientError as e:
+            if e.response['Error']['Code'] != 'ConditionalCheckFailedException':
+                raise
+        time.sleep(0.2 * (2 ** attempt))
+    raise Exception(f'Could not reconcile Total for note {note_id}')
+
+def read_note_items(note_id, max_retries=5):
+    """The note row (read consistently) and all of its items, or (None, []).
+
+    The SalesNoteID index is eventually consistent, so items written just
+    before may be missing from it. Fewer items than the note's ItemCount
+    means it has not caught up yet, and the read is retried; more only
+    happens for notes written before ItemCount existed.
+    """
+    for attempt in range(max_retries + 1):
+        note = sales_notes_table.get_item(Key={'ID': note_id}, ConsistentRead=True).get('Item')
+        if not note:
+            return None, []
+        items = query_note_items(note_id)
+        if len(items) >= note.get('ItemCount', 0):
+            return note, items
+        time.sleep(0.1 * (2 ** attempt))
+    raise Exception(f'Items of note {note_id} are not in the index yet')
+
+@traced('query_items')
+def query_note_items(note_id):
+    items = []
+    query_kwargs = {
+        'IndexName': SALES_NOTE_ITEMS_INDEX,
+        'KeyConditionExpression': Key('SalesNoteID').eq(note_id)
+    }
+    while True:
+        response = sales_note_items_table.query(**query_kwargs)
+        items.extend(response['Items'])
+        if 'LastEvaluatedKey' not in response:
+            return items
+        query_kwargs['ExclusiveStartKey'] = response['LastEvaluatedKey']
+
+def get_client(client_id):
+    return clients_cache.get_or_load(client_id, lambda key: clients_table.get_item(Key={'ID': key}).get('Item'))
+
+@traced('product_lookup')
+def resolve_products(product_ids):
+    return products_cache.get_many(product_ids, fetch_products)
+
+def resolve_clients(client_ids):
+    return clients_cache.get_many(client_ids, lambda ids: batch_get('Clients', ids))
+
+def fetch_products(product_ids):
+    return batch_get('Products', product_ids)
+
+def batch_get(table_name, item_ids, max_retries=5):
+    """{ID: item} for the given IDs, in BATCH_GET_LIMIT sized batch_get_item calls."""
+    found = {}
+    keys = [{'ID': item_id} for item_id in dict.fromkeys(item_ids)]
+    for start in range(0, len(keys), BATCH_GET_LIMIT):
+        request_items = {table_name: {'Keys': keys[start:start + BATCH_GET_LIMIT]}}
+        attempt = 0
+        while request_items:
+            response = dynamodb.batch_get_item(RequestItems=request_items)
+            for item in response['Responses'].get(table_name, []):
+                found[item['ID']] = item
+            request_items = response.get('UnprocessedKeys')
+            if request_items:
+                if attempt >= max_retries:
+                    raise Exception(f'Could not fetch {table_name}: unprocessed keys after retries')
+                time.sleep(0.05 * (2 ** attempt))
+                attempt += 1
+    return found
+
+@traced('render_pdf')
+def generate_pdf(client, folio, items, products, sink=None):
+    # reportlab is imported here so routes that never render skip its import cost
+    import pdf_templates
+
+    sink = sink if sink is not None else BytesIO()
+    with span('pdf_build'):
+        pdf_templates.render_note(sink, client, folio, items, products)
+    return sink
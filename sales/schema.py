@@ -0,0 +1,124 @@
+import time
+import boto3
+
+SALES_NOTE_ITEMS_INDEX = 'SalesNoteID-index'
+OUTBOX_TABLE = 'NotificationsOutbox'
+# notifications/outbox_relay.py reads pending notifications, oldest first
+OUTBOX_INDEX = 'Estado-index'
+SALES_NOTES_FOLIO_INDEX = 'Folio-index'
+# rollup_stream.py reads new items from this table's stream
+STREAMS = {'SalesNoteItems': 'NEW_IMAGE'}
+# all of a client's notes; hash-only, because notes created before Fecha
+# existed have none and an index leaves out items without its range key
+SALES_NOTES_CLIENT_INDEX = 'ClienteID-index'
+# catalogs/catalogs_lambda.py looks clients up by RFC
+CLIENTS_RFC_INDEX = 'RFC-index'
+
+# Secondary indexes the sales, catalogs and notifications Lambdas query. Apply them with
+# `python schema.py` before deploying code that depends on them.
+INDEXES = {
+    'SalesNoteItems': [
+        {
+            'IndexName': SALES_NOTE_ITEMS_INDEX,
+            'KeySchema': [{'AttributeName': 'SalesNoteID', 'KeyType': 'HASH'}],
+            'AttributeDefinitions': [{'AttributeName': 'SalesNoteID', 'AttributeType': 'S'}],
+        },
+    ],
+    'SalesNotes': [
+        {
+            'IndexName': SALES_NOTES_FOLIO_INDEX,
+            'KeySchema': [{'AttributeName': 'Folio', 'KeyType': 'HASH'}],
+            'AttributeDefinitions': [{'AttributeName': 'Folio', 'AttributeType': 'S'}],
+        },
+        {
+            'IndexName': SALES_NOTES_CLIENT_INDEX,
+            'KeySchema': [{'AttributeName': 'ClienteID', 'KeyType': 'HASH'}],
+            'AttributeDefinitions': [{'AttributeName': 'ClienteID', 'AttributeType': 'S'}],
+        },
+    ],
+    'Clients': [
+        {
+            'IndexName': CLIENTS_RFC_INDEX,
+            'KeySchema': [{'AttributeName': 'RFC', 'KeyType': 'HASH'}],
+            'AttributeDefinitions': [{'AttributeName': 'RFC', 'AttributeType': 'S'}],
+        },
+    ],
+    OUTBOX_TABLE: [
+        {
+            'IndexName': OUTBOX_INDEX,
+            'KeySchema': [
+                {'AttributeName': 'Estado', 'KeyType': 'HASH'},
+                {'AttributeName': 'ActualizadoEn', 'KeyType': 'RANGE'},
+            ],
+            'AttributeDefinitions': [
+                {'AttributeName': 'Estado', 'AttributeType': 'S'},
+                {'AttributeName': 'ActualizadoEn', 'AttributeType': 'S'},
+            ],
+        },
+    ],
+}
+
+
+def wait_for_index(client, table_name, index_name, delay=10):
+    while True:
+        table = client.describe_table(TableName=table_name)['Table']
+        statuses = {i['IndexName']: i['IndexStatus'] for i in table.get('GlobalSecondaryIndexes', [])}
+        if statuses.get(index_name) == 'ACTIVE':
+            return
+        time.sleep(delay)
+
+
+def ensure_indexes(client=None):
+    client = client or boto3.client('dynamodb')
+    created = []
+    for table_name, indexes in INDEXES.items():
+        table = client.describe_table(TableName=table_name)['Table']
+        existing = {i['IndexName']: i['KeySchema'] for i in table.get('GlobalSecondaryIndexes', [])}
+        for index in indexes:
+            if index['IndexName'] in existing:
+                if existing[index['IndexName']] != index['KeySchema']:
+                    # an index's keys cannot be changed in place
+                    raise Exception(f"{table_name}.{index['IndexName']} has other keys than declared; delete it and run this again")
+                continue
+            create = {
+                'IndexName': index['IndexName'],
+                'KeySchema': index['KeySchema'],
+                'Projection': {'ProjectionType': 'ALL'},
+            }
+            if table.get('BillingModeSummary', {}).get('BillingMode') != 'PAY_PER_REQUEST':
+                create['ProvisionedThroughput'] = {'ReadCapacityUnits': 5, 'WriteCapacityUnits': 5}
+            # DynamoDB only accepts one GSI creation per UpdateTable call
+            client.update_table(
+                TableName=table_name,
+                AttributeDefinitions=index['AttributeDefinitions'],
+                GlobalSecondaryIndexUpdates=[{'Create': create}]
+            )
+            wait_for_index(client, table_name, index['IndexName'])
+            created.append(f"{table_name}.{index['IndexName']}")
+    return created
+
+
+def ensure_streams(client=None):
+    client = client or boto3.client('dynamodb')
+    enabled = []
+    for table_name, view_type in STREAMS.items():
+        table = client.describe_table(TableName=table_name)['Table']
+        spec = table.get('StreamSpecification', {})
+        if spec.get('StreamEnabled'):
+            if spec.get('StreamViewType') != view_type:
+                # the view type of an enabled stream cannot be changed in place
+                raise Exception(f"{table_name} has a {spec.get('StreamViewType')} stream; {view_type} is needed")
+            continue
+        client.update_table(
+            TableName=table_name,
+            StreamSpecification={'StreamEnabled': True, 'StreamViewType': view_type}
+        )
+        enabled.append(table_name)
+    return enabled
+
+
+if __name__ == '__main__':
+    for name in ensure_indexes():
+        print(f'Created index {name}')
+    for name in ensure_streams():
+        print(f'Enabled stream of {name}')
@@ -0,0 +1,109 @@
+import cProfile
+import functools
+import json
+import os
+import random
+import threading
+import time
+from contextlib import contextmanager
+
+import aws
+import metrics
+
+# Fraction of invocations that run under cProfile (0 disables profiling)
+PROFILE_SAMPLE_RATE = float(os.getenv('PROFILE_SAMPLE_RATE', '0'))
+PROFILE_DIR = os.getenv('PROFILE_DIR', '/tmp/profiles')
+# When set, sampled profiles are also uploaded to s3://PROFILE_BUCKET/profiles/
+PROFILE_BUCKET = os.getenv('PROFILE_BUCKET', '')
+
+_lock = threading.Lock()
+_stages = {}
+_aws_calls = {}
+
+
+@contextmanager
+def span(name):
+    """Time a stage of the current request. Repeated stages accumulate."""
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        elapsed = (time.perf_counter() - start) * 1000
+        with _lock:
+            total, count = _stages.get(name, (0.0, 0))
+            _stages[name] = (total + elapsed, count + 1)
+
+
+def traced(name):
+    def decorator(func):
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            with span(name):
+                return func(*args, **kwargs)
+        return wrapper
+    return decorator
+
+
+def _count_aws_call(model, **kwargs):
+    operation = f'{model.service_model.service_name}.{model.name}'
+    with _lock:
+        _aws_calls[operation] = _aws_calls.get(operation, 0) + 1
+
+
+def instrument_client(client):
+    """Count every API call made through a boto3 client (or resource.meta.client)."""
+    client.meta.events.register('before-call', _count_aws_call)
+    return client
+
+
+def _reset():
+    with _lock:
+        _stages.clear()
+        _aws_calls.clear()
+
+
+def _emit(request_id):
+    with _lock:
+        stages = dict(_stages)
+        aws_calls = dict(_aws_calls)
+    for name, (total, count) in stages.items():
+        metrics.put('StageLatencyMs', total, unit='Milliseconds', Stage=name)
+    metrics.put('AwsCalls', sum(aws_calls.values()))
+    print(json.dumps({
+        'trace': request_id,
+        'stages': {name: {'ms': round(total, 3), 'count': count} for name, (total, count) in stages.items()},
+        'aws_calls': aws_calls
+    }))
+
+
+def _save_profile(profiler, request_id):
+    os.makedirs(PROFILE_DIR, exist_ok=True)
+    path = os.path.join(PROFILE_DIR, f'{request_id}.prof')
+    profiler.dump_stats(path)
+    if PROFILE_BUCKET:
+        aws.client('s3').upload_file(path, PROFILE_BUCKET, f'profiles/{request_id}.prof')
+    return path
+
+
+def trace_request(handler):
+    """Collect stage timings and AWS call counts for one invocation."""
+    @functools.wraps(handler)
+    def wrapper(event, context):
+        _reset()
+        request_id = getattr(context, 'aws_request_id', None) or str(time.time_ns())
+        profiler = None
+        if PROFILE_SAMPLE_RATE and random.random() < PROFILE_SAMPLE_RATE:
+            profiler = cProfile.Profile()
+            profiler.enable()
+        try:
+            with span('total'):
+                return handler(event, context)
+        finally:
+            if profiler:
+                profiler.disable()
+                try:
+                    _save_profile(profiler, request_id)
+                except Exception as e:
+                    print(f'Error saving profile: {e}')
+            _emit(request_id)
+    return wrapper
@@ -0,0 +1,128 @@
+"""Concurrent appends to one sales note, against moto as the DynamoDB stand-in.
+
+moto is not thread-safe (its transactions deep-copy the tables while other
+threads write them), so every AWS call goes through one lock. Requests still
+interleave between calls, which is what the Total and ItemCount have to
+survive.
+"""
+import importlib
+import os
+import random
+import sys
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from decimal import Decimal
+
+import boto3
+import botocore.client
+import pytest
+from botocore.exceptions import ClientError
+
+moto = pytest.importorskip('moto')
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..', 'sales'))
+
+APPENDS = 20
+
+
+def create_table(client, name, indexes=()):
+    attributes = {'ID': 'S'}
+    key_schema = [{'AttributeName': 'ID', 'KeyType': 'HASH'}]
+    kwargs = {}
+    if indexes:
+        kwargs['GlobalSecondaryIndexes'] = []
+        for index_name, hash_key in indexes:
+            attributes[hash_key] = 'S'
+            kwargs['GlobalSecondaryIndexes'].append({
+                'IndexName': index_name,
+                'KeySchema': [{'AttributeName': hash_key, 'KeyType': 'HASH'}],
+                'Projection': {'ProjectionType': 'ALL'},
+            })
+    client.create_table(
+        TableName=name,
+        KeySchema=key_schema,
+        AttributeDefinitions=[{'AttributeName': k, 'AttributeType': t} for k, t in attributes.items()],
+        BillingMode='PAY_PER_REQUEST',
+        **kwargs
+    )
+
+
+@pytest.fixture
+def sales(monkeypatch):
+    for name, value in {
+        'AWS_DEFAULT_REGION': 'us-east-1',
+        'AWS_ACCESS_KEY_ID': 'testing',
+        'AWS_SECRET_ACCESS_KEY': 'testing',
+    }.items():
+        monkeypatch.setenv(name, value)
+
+    lock = threading.Lock()
+    make_api_call = botocore.client.BaseClient._make_api_call
+
+    def serialized(self, operation_name, api_params):
+        with lock:
+            return make_api_call(self, operation_name, api_params)
+
+    monkeypatch.setattr(botocore.client.BaseClient, '_make_api_call', serialized)
+
+    with moto.mock_aws():
+        client = boto3.client('dynamodb')
+        for name in ['Clients', 'Products', 'SalesNotes', 'NotificationsOutbox', 'CacheVersions']:
+            create_table(client, name)
+        create_table(client, 'SalesNoteItems', [('SalesNoteID-index', 'SalesNoteID')])
+        sales_lambda = importlib.reload(importlib.import_module('sales_lambda'))
+        resource = boto3.resource('dynamodb')
+        resource.Table('SalesNotes').put_item(Item={'ID': 'n1', 'Folio': 'f1', 'ClienteID': 'c1', 'Total': Decimal(0)})
+        with resource.Table('Products').batch_writer() as batch:
+            for i in range(10):
+                batch.put_item(Item={'ID': f'p{i}', 'Nombre': f'Producto {i}'})
+        yield sales_lambda
+
+
+def test_parallel_appends_keep_total_exact(sales):
+    note = sales.sales_notes_table.get_item(Key={'ID': 'n1'})['Item']
+    rng = random.Random(4)
+    batches = [
+        [{'ProductoID': f'p{rng.randrange(10)}', 'Cantidad': rng.randint(1, 5), 'PrecioUnitario': f'{rng.randint(1, 99999) / 100:.2f}'}
+         for _ in range(rng.randint(1, 110))]
+        for _ in range(APPENDS)
+    ]
+
+    def append(items):
+        rows, _, errors = sales.validate_note_items('n1', items)
+        assert not errors
+        sales.write_note_items(note, rows)
+        return rows
+
+    with ThreadPoolExecutor(max_workers=8) as executor:
+        written = [row for rows in executor.map(append, batches) for row in rows]
+
+    stored = sales.sales_notes_table.get_item(Key={'ID': 'n1'}, ConsistentRead=True)['Item']
+    assert stored['Total'] == sum((row['Importe'] for row in written), Decimal(0))
+    assert stored['ItemCount'] == len(written) == sum(len(b) for b in batches)
+    assert len(sales.query_note_items('n1')) == len(written)
+    assert sales.reconcile_total('n1') == stored['Total']
+
+
+def test_only_conflicts_and_throttling_are_retried(sales, monkeypatch):
+    calls = []
+
+    def cancelled(reason):
+        def transact_write_items(**kwargs):
+            calls.append(reason)
+            raise ClientError({
+                'Error': {'Code': 'TransactionCanceledException', 'Message': reason},
+                'CancellationReasons': [{'Code': 'None'}, {'Code': reason}],
+            }, 'TransactWriteItems')
+        return transact_write_items
+
+    monkeypatch.setattr(sales.time, 'sleep', lambda seconds: None)
+    note = {'ID': 'n1', 'ClienteID': 'c1'}
+    row = {'ID': 'i1', 'SalesNoteID': 'n1', 'ProductoID': 'p1', 'Cantidad': 1, 'PrecioUnitario': Decimal(1), 'Importe': Decimal(1)}
+
+    for reason, attempts in [('ValidationError', 1), ('ConditionalCheckFailed', 1), ('TransactionConflict', 4)]:
+        calls.clear()
+        monkeypatch.setattr(sales.dynamodb.meta.client, 'transact_write_items', cancelled(reason))
+        with pytest.raises(ClientError):
+            sales.write_items_transaction(note, [row], max_retries=3)
+        assert len(calls) == attempts, reason